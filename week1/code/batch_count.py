@@ -0,0 +1,423 @@
+"""Vectorized k-mer counting with NumPy, for DBG(batch_size=...).
+
+Reads are packed into blocks of about block_size bases and turned into a
+uint8 array of base codes. The packed code of every k-mer window of the block,
+and of its reverse complement, is then built by joining shorter windows over
+the whole array. The k-mers a serial build would insert are gathered in its
+insertion order and counted by sorting, and every arc is kept as the (k+1)-mer
+that spells it. Blocks are merged by sorting, and node ids are handed out by first
+occurrence, so the graph is identical to the one DBG._build_columns (or
+DBG._build_bidirected) builds one k-mer at a time.
+
+count_kmers_partitioned produces the same counts for inputs whose k-mers do
+not fit in memory: the per-block tables go to bucket files on disk, split by
+hash, and each bucket is merged on its own.
+"""
+
+import os
+import tempfile
+from array import array
+
+import numpy as np
+
+# 2-bit codes of ACGT/acgt, as in dbg; anything else is flagged with 4
+_CODES = np.full(256, 4, dtype=np.uint8)
+for _code, _base in enumerate('ACGT'):
+    _CODES[ord(_base)] = _CODES[ord(_base.lower())] = _code
+
+
+def encode_reads(reads):
+    """Return the base codes of reads, concatenated, and the start of each read."""
+    parts = [read.encode() if isinstance(read, str) else read for read in reads]
+    lengths = np.fromiter(map(len, parts), dtype=np.int64, count=len(parts))
+    codes = _CODES[np.frombuffer(b''.join(parts), dtype=np.uint8)]
+    bad = np.flatnonzero(codes > 3)
+    if len(bad):
+        # the same error the serial build raises
+        raise KeyError(chr(b''.join(parts)[bad[0]]))
+    starts = np.zeros(len(parts), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    return codes, starts, lengths
+
+
+def window_codes(codes, k):
+    """Return the codes of every k-mer window of codes and of its reverse complement.
+
+    Windows of 1, 2, 4, ... bases are built by joining two windows of half the
+    width, and those whose width is a binary digit of k are joined into the
+    k-mer windows, so the whole array is passed over about 2 log2(k) times.
+    """
+    n = len(codes) - k + 1
+    if n <= 0:
+        return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.uint64)
+    part = codes.astype(np.uint64)
+    part_rc = np.uint64(3) - part
+    fwd = rc = None
+    width, step = 0, 1
+    while True:
+        if k & step:
+            if fwd is None:
+                fwd, rc = part, part_rc
+            else:
+                # append the step-wide windows that start where these end
+                size = len(codes) - width - step + 1
+                fwd = (fwd[:size] << np.uint64(2 * step)) | part[width:width + size]
+                rc = (part_rc[width:width + size] << np.uint64(2 * width)) | rc[:size]
+            width += step
+        if width == k:
+            return fwd[:n], rc[:n]
+        size = len(codes) - 2 * step + 1
+        part = (part[:size] << np.uint64(2 * step)) | part[step:step + size]
+        part_rc = (part_rc[step:step + size] << np.uint64(2 * step)) | part_rc[:size]
+        step *= 2
+
+
+def reverse_complement_codes(kmers, k):
+    # complement every base, then reverse the 2-bit groups of each word
+    x = ~kmers
+    x = ((x >> np.uint64(2)) & np.uint64(0x3333333333333333)) | \
+        ((x & np.uint64(0x3333333333333333)) << np.uint64(2))
+    x = ((x >> np.uint64(4)) & np.uint64(0x0F0F0F0F0F0F0F0F)) | \
+        ((x & np.uint64(0x0F0F0F0F0F0F0F0F)) << np.uint64(4))
+    return x.byteswap() >> np.uint64(64 - 2 * k)
+
+
+def _ranges(starts, counts):
+    # starts[i], starts[i] + 1, ..., starts[i] + counts[i] - 1 for every i
+    ends = np.cumsum(counts)
+    offsets = np.repeat(ends - counts, counts)
+    return np.repeat(starts, counts) + np.arange(ends[-1] if len(ends) else 0) - offsets
+
+
+def count_block(reads, k, bidirected=False, kmer_filter=None):
+    """Count the k-mers and arcs of one block of reads.
+
+    Returns the distinct k-mers (sorted), the position of the first insertion
+    of each within the block, their counts, the distinct arcs as (k+1)-mers,
+    and the number of insertions. A bidirected block counts canonical k-mers
+    along the forward strand only and keeps the canonical (k+1)-mer of each
+    arc, like canonical_arcs.
+
+    With a kmer_filter, the occurrences of every k-mer of the block are
+    counted in the filter at once, and only the k-mers it admits after that
+    and the arcs between them are kept. Unlike the serial build, a k-mer
+    admitted in a block keeps all of its insertions in that block.
+    """
+    codes, starts, lengths = encode_reads(reads)
+    fwd, rc = window_codes(codes, k)
+    two = np.uint64(2)
+    # arc holds the window of the first k-mer of every arc
+    if bidirected:
+        n_arcs = np.maximum(lengths - k, 0)
+        arc = _ranges(starts, n_arcs)
+        canonical = np.minimum(fwd, rc)
+        inserted = np.stack([canonical[arc], canonical[arc + 1]], axis=1).ravel()
+        arcs = np.minimum((fwd[arc] << two) | (fwd[arc + 1] & np.uint64(3)),
+                          (rc[arc + 1] << two) | (rc[arc] & np.uint64(3)))
+    else:
+        # read_arcs leaves out the last arc of each strand
+        n_arcs = np.maximum(lengths - k - 1, 0)
+        arc = _ranges(starts, n_arcs)
+        mirror = np.repeat(starts + lengths - k, n_arcs) - (arc - np.repeat(starts, n_arcs))
+        inserted = np.stack([fwd[arc], fwd[arc + 1], rc[mirror], rc[mirror - 1]],
+                            axis=1).ravel()
+        arcs = np.concatenate([(fwd[arc] << two) | (fwd[arc + 1] & np.uint64(3)),
+                               (rc[mirror] << two) | (rc[mirror - 1] & np.uint64(3))])
+    kmers, first, counts = _reduce(inserted, np.arange(len(inserted)))
+    arcs = _distinct(np.sort(arcs))
+    if kmer_filter is not None:
+        # every k-mer on an arc, once per occurrence: the arc starts, plus the
+        # k-mer that ends the last arc of each read
+        last = (starts + n_arcs)[n_arcs > 0]
+        if bidirected:
+            occurrences = np.concatenate([canonical[arc], canonical[last]])
+        else:
+            first_rc = (starts + 1)[n_arcs > 0]
+            occurrences = np.concatenate([fwd[arc], fwd[last], rc[mirror], rc[first_rc]])
+        occurrences = np.sort(occurrences)
+        heads = _heads(occurrences)
+        # the same k-mers as the insertions, in the same order
+        n_seen = np.diff(np.append(heads, len(occurrences)))
+        before = kmer_filter.add_counts(kmers, n_seen).astype(np.int64)
+        admitted = before + n_seen >= kmer_filter.min_count
+        # occurrences before this block only reached the filter; each stands
+        # for two insertions
+        counts = counts + 2 * np.where(before < kmer_filter.min_count, before, 0)
+        kmers, first, counts = kmers[admitted], first[admitted], counts[admitted]
+        arcs = arcs[_admitted_arcs(arcs, k, bidirected, kmer_filter)]
+    return kmers, first, counts, arcs, len(inserted)
+
+
+def _admitted_arcs(arcs, k, bidirected, kmer_filter):
+    # an arc is kept when the filter has admitted both of its k-mers
+    mask = np.uint64((1 << (2 * k)) - 1)
+    ends = [arcs >> np.uint64(2), arcs & mask]
+    if bidirected:
+        ends = [np.minimum(end, reverse_complement_codes(end, k)) for end in ends]
+    return ((kmer_filter.estimate(ends[0]) >= kmer_filter.min_count)
+            & (kmer_filter.estimate(ends[1]) >= kmer_filter.min_count))
+
+
+def _heads(values):
+    # the index of the first of every run of equal values
+    heads = np.ones(len(values), dtype=bool)
+    heads[1:] = values[1:] != values[:-1]
+    return np.flatnonzero(heads)
+
+
+def _distinct(values):
+    return values[_heads(values)]
+
+
+def _reduce(kmers, first, counts=None):
+    """Return the distinct kmers with their earliest first and their summed counts.
+
+    counts defaults to one per entry. A plain argsort is enough, since the
+    earliest entry of every k-mer is found with a minimum rather than by
+    keeping the entries in order.
+    """
+    order = np.argsort(kmers)
+    kmers = kmers[order]
+    heads = _heads(kmers)
+    first = np.minimum.reduceat(first[order], heads)
+    if counts is None:
+        counts = np.diff(np.append(heads, len(kmers)))
+    else:
+        counts = np.add.reduceat(counts[order], heads)
+    return kmers[heads], first, counts
+
+
+def _blocks(reads, block_size):
+    block, size = [], 0
+    for read in reads:
+        block.append(read)
+        size += len(read)
+        if size >= block_size:
+            yield block
+            block, size = [], 0
+    if block:
+        yield block
+
+
+def _merge(tables):
+    # sort-merge (kmers, first, counts) tables into one
+    return _reduce(*(np.concatenate(column) for column in zip(*tables)))
+
+
+def count_kmers(reads, k, block_size, bidirected=False, kmer_filter=None):
+    """Count the k-mers and arcs of reads in blocks of about block_size bases.
+
+    Returns the k-mers and counts in node id order, the rank (node id) of
+    every k-mer of the sorted k-mer array, that array, and the distinct arcs
+    as (k+1)-mers.
+    """
+    tables, arc_blocks = [], []
+    offset = 0
+    for block in _blocks(reads, block_size):
+        kmers, index, counts, arcs, n_inserted = count_block(block, k, bidirected, kmer_filter)
+        tables.append((kmers, index + offset, counts))
+        arc_blocks.append(arcs)
+        offset += n_inserted
+        # fold the new blocks into the first table once they are as large as
+        # it, so the blocks of a large input are not all kept until the end
+        if sum(len(table[0]) for table in tables[1:]) >= len(tables[0][0]):
+            tables = [_merge(tables)]
+            arc_blocks = [_distinct(np.sort(np.concatenate(arc_blocks)))]
+    if not tables:
+        empty = np.zeros(0, dtype=np.uint64)
+        return empty, empty, np.zeros(0, dtype=np.int64), empty, empty
+
+    kmers, first, counts = _merge(tables)
+    arcs = _distinct(np.sort(np.concatenate(arc_blocks)))
+    return _number(kmers, first, counts, arcs)
+
+
+def _number(kmers, first, counts, arcs):
+    # hand out node ids by first occurrence; kmers must be sorted
+    by_id = np.argsort(first, kind='stable')
+    rank = np.empty(len(kmers), dtype=np.int64)
+    rank[by_id] = np.arange(len(kmers))
+    return kmers[by_id], counts[by_id], rank, kmers, arcs
+
+
+# rough peak bytes taken while counting, per base of a block of reads and
+# per record of a bucket
+BYTES_PER_BASE = 160
+BYTES_PER_RECORD = 80
+# a bucket is split at most this many times over
+_MAX_LEVEL = 4
+_RECORD = np.dtype([('kmer', np.uint64), ('first', np.int64), ('count', np.uint32)])
+
+
+def _bucket_of(values, n_buckets, level):
+    # the splitmix64 finalizer, seeded differently at every level of splitting
+    x = values ^ np.uint64((0x9E3779B97F4A7C15 * (level + 1)) & ((1 << 64) - 1))
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    x ^= x >> np.uint64(31)
+    return (x % np.uint64(n_buckets)).astype(np.intp)
+
+
+def _scatter(records, keys, files, level):
+    # append every record to the file of the bucket its key hashes to
+    buckets = _bucket_of(keys, len(files), level)
+    order = np.argsort(buckets, kind='stable')
+    bounds = np.searchsorted(buckets[order], np.arange(len(files) + 1))
+    records = records[order]
+    for i, f in enumerate(files):
+        records[bounds[i]:bounds[i + 1]].tofile(f)
+
+
+def _open_buckets(directory, name, n_buckets):
+    paths = [os.path.join(directory, '%s-%d' % (name, i)) for i in range(n_buckets)]
+    return paths, [open(path, 'wb') for path in paths]
+
+
+def _split_bucket(kmer_path, arc_path, n_buckets, memory, level):
+    # route the records of a bucket that is too large into smaller buckets
+    directory = os.path.dirname(kmer_path)
+    name = os.path.basename(kmer_path)
+    kmer_paths, kmer_files = _open_buckets(directory, name + '.k', n_buckets)
+    arc_paths, arc_files = _open_buckets(directory, name + '.a', n_buckets)
+    chunk = max(memory // BYTES_PER_RECORD, 1)
+    for path, dtype, files in ((kmer_path, _RECORD, kmer_files), (arc_path, np.uint64, arc_files)):
+        with open(path, 'rb') as f:
+            while True:
+                records = np.fromfile(f, dtype=dtype, count=chunk)
+                if not len(records):
+                    break
+                keys = records['kmer'] if dtype is _RECORD else records
+                _scatter(records, keys, files, level)
+        os.remove(path)
+    for f in kmer_files + arc_files:
+        f.close()
+    return list(zip(kmer_paths, arc_paths))
+
+
+def _reduce_bucket(kmer_path, arc_path, n_buckets, memory, level, tables, arc_tables):
+    """Count one bucket, splitting it first when it does not fit in memory."""
+    n_records = (os.path.getsize(kmer_path) // _RECORD.itemsize
+                 + os.path.getsize(arc_path) // 8)
+    if memory is not None and n_records * BYTES_PER_RECORD > memory and level < _MAX_LEVEL:
+        for paths in _split_bucket(kmer_path, arc_path, n_buckets, memory, level + 1):
+            _reduce_bucket(*paths, n_buckets, memory, level + 1, tables, arc_tables)
+        return
+    records = np.fromfile(kmer_path, dtype=_RECORD)
+    kmers, first, counts = _reduce(records['kmer'], records['first'], records['count'])
+    tables.append((kmers, first, counts.astype(np.uint32)))
+    del records
+    arc_tables.append(_distinct(np.sort(np.fromfile(arc_path, dtype=np.uint64))))
+    os.remove(kmer_path)
+    os.remove(arc_path)
+
+
+def count_kmers_partitioned(reads, k, block_size, n_buckets, memory=None, tmpdir=None,
+                            bidirected=False, kmer_filter=None):
+    """Count like count_kmers, keeping the per-block tables on disk.
+
+    The k-mers and arcs of every block are routed by hash to n_buckets
+    bucket files in a temporary directory under tmpdir. Each bucket is then
+    counted on its own, since all records of a k-mer land in the same one;
+    with a memory limit in bytes, blocks are kept small enough to count
+    within it and a bucket too large for it is split again by another hash.
+    Only the counted buckets, the size of the final graph, are held together.
+    """
+    if memory is not None:
+        block_size = max(min(block_size, memory // BYTES_PER_BASE), 1)
+    tables, arc_tables = [], []
+    with tempfile.TemporaryDirectory(prefix='dbg-buckets-', dir=tmpdir) as directory:
+        kmer_paths, kmer_files = _open_buckets(directory, 'kmers', n_buckets)
+        arc_paths, arc_files = _open_buckets(directory, 'arcs', n_buckets)
+        offset = 0
+        for block in _blocks(reads, block_size):
+            kmers, index, counts, arcs, n_inserted = count_block(block, k, bidirected, kmer_filter)
+            records = np.empty(len(kmers), dtype=_RECORD)
+            records['kmer'], records['first'], records['count'] = kmers, index + offset, counts
+            _scatter(records, kmers, kmer_files, 0)
+            _scatter(arcs, arcs, arc_files, 0)
+            offset += n_inserted
+        for f in kmer_files + arc_files:
+            f.close()
+        for paths in zip(kmer_paths, arc_paths):
+            _reduce_bucket(*paths, n_buckets, memory, 0, tables, arc_tables)
+
+    # buckets hold disjoint k-mers, so stitching them is a plain sort; the
+    # columns are gathered one at a time to keep few copies around
+    kmers = np.concatenate([table[0] for table in tables])
+    order = np.argsort(kmers)
+    kmers = kmers[order]
+    first = np.concatenate([table[1] for table in tables])[order]
+    counts = np.concatenate([table[2] for table in tables])[order]
+    del tables, order
+    arcs = np.sort(np.concatenate(arc_tables))
+    return _number(kmers, first, counts, arcs)
+
+
+_DTYPES = {'Q': np.uint64, 'I': np.uint32, 'i': np.int32}
+
+
+def _column(typecode, values):
+    # the array module column the stores expect, filled without a Python loop
+    column = array(typecode)
+    column.frombytes(values.astype(_DTYPES[typecode]).tobytes())
+    return column
+
+
+def _csr(sources, targets, n):
+    # sources must already be sorted; the offsets of every id up to n
+    offsets = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=n), out=offsets[1:])
+    return _column('I', offsets), _column('i', targets)
+
+
+def _count(reads, k, block_size, bidirected, kmer_filter, partitions, memory, tmpdir):
+    if partitions > 0:
+        return count_kmers_partitioned(reads, k, block_size, partitions, memory, tmpdir,
+                                       bidirected, kmer_filter)
+    return count_kmers(reads, k, block_size, bidirected, kmer_filter)
+
+
+def build_columns(reads, k, block_size, kmer_filter=None, partitions=0, memory=None,
+                  tmpdir=None):
+    """Return the columns of NodeStore.from_adjacency for reads.
+
+    With partitions > 0 the k-mers are counted in that many buckets on disk
+    (see count_kmers_partitioned).
+    """
+    kmers, counts, rank, ordered, arcs = _count(reads, k, block_size, False, kmer_filter,
+                                                partitions, memory, tmpdir)
+    mask = np.uint64((1 << (2 * k)) - 1)
+    parents = rank[np.searchsorted(ordered, arcs >> np.uint64(2))]
+    children = rank[np.searchsorted(ordered, arcs & mask)]
+    # children in order of their last base, parents in order of id
+    order = np.lexsort((arcs & np.uint64(3), parents))
+    child_offsets, child_targets = _csr(parents[order], children[order], len(kmers))
+    order = np.lexsort((parents, children))
+    parent_offsets, parent_targets = _csr(children[order], parents[order], len(kmers))
+    return (_column('Q', kmers), _column('I', counts), child_offsets, child_targets,
+            parent_offsets, parent_targets)
+
+
+def build_bidirected_columns(reads, k, block_size, kmer_filter=None, partitions=0, memory=None,
+                             tmpdir=None):
+    """Return the columns of BidirectedStore.from_adjacency for reads."""
+    kmers, counts, rank, ordered, arcs = _count(reads, k, block_size, True, kmer_filter,
+                                                partitions, memory, tmpdir)
+    mask = np.uint64((1 << (2 * k)) - 1)
+    three = np.uint64(3)
+
+    def oriented(codes):
+        # the oriented node id of every k-mer in codes
+        rc = reverse_complement_codes(codes, k)
+        canonical = np.minimum(codes, rc)
+        return 2 * rank[np.searchsorted(ordered, canonical)] + (codes != canonical)
+
+    # arc kmer1 -> kmer2, and its reverse complement rc(kmer2) -> rc(kmer1)
+    kmer1, kmer2 = oriented(arcs >> np.uint64(2)), oriented(arcs & mask)
+    palindrome = arcs == reverse_complement_codes(arcs, k + 1)
+    sources = np.concatenate([kmer1, (kmer2 ^ 1)[~palindrome]])
+    targets = np.concatenate([kmer2, (kmer1 ^ 1)[~palindrome]])
+    bases = np.concatenate([arcs & three, (three - (arcs >> np.uint64(2 * k)))[~palindrome]])
+    order = np.lexsort((bases, sources))
+    child_offsets, child_targets = _csr(sources[order], targets[order], 2 * len(kmers))
+    return _column('Q', kmers), _column('I', counts), child_offsets, child_targets
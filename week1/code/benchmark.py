@@ -0,0 +1,202 @@
+"""Benchmark the assembler phase by phase and compare against a stored baseline.
+
+Every run assembles one dataset in a fresh worker process, so peak RSS is
+measured per run, and times the phases separately:
+
+    read    load the three read files into memory (--reader list only; the
+            streaming readers parse reads while the graph is built, as
+            main.py runs them, so their time counts under build)
+    build   count k-mers into the graph (plus cleaning and compaction)
+    search  find the longest paths, including incremental depth updates
+    delete  detach the extracted paths from the graph
+    write   concatenate the contigs and write them out
+
+The contig phases are timed by DBG.get_longest_contig itself, so the
+benchmark runs the same code as main.py.
+
+Usage:
+    python benchmark.py data1 data2 --repeat 5 --output bench.json
+    python benchmark.py --baseline bench.json --tolerance 0.2
+
+With --baseline, the median phase times and the peak RSS of each dataset are
+compared with the stored run, and the script exits with status 1 when any of
+them grew by more than the tolerance.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+from dbg import DBG
+from kmer_filter import KmerFilter
+from n50 import compute_n50
+from utils import stream_data, stream_reads, mmap_reads
+
+PHASES = ['read', 'build', 'search', 'delete', 'write']
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+
+
+def count_edges(dbg):
+    # a bidirected graph stores every edge once per strand, except an edge
+    # into the k-mer's own reverse complement, which is its own twin
+    edges = twins = 0
+    for idx in dbg.nodes:
+        children = dbg.nodes[idx].get_children()
+        edges += len(children)
+        if dbg.bidirected:
+            twins += (idx ^ 1) in children
+    return (edges + twins) // 2 if dbg.bidirected else edges
+
+
+def run_once(config):
+    dataset, k, n_contigs = config['dataset'], config['k'], config['contigs']
+    times = dict.fromkeys(PHASES, 0.0)
+
+    start = time.perf_counter()
+    path = os.path.join(DATA_DIR, dataset)
+    if config['reader'] == 'list':
+        data_list = [list(reads) for reads in stream_data(path)]
+    else:
+        reader = mmap_reads if config['reader'] == 'mmap' else stream_reads
+        data_list = stream_data(path, reader)
+    times['read'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    kmer_filter = None
+    if config['min_count'] > 1:
+        kmer_filter = KmerFilter(config['filter_memory'] << 20, config['min_count'])
+    dbg = DBG(k=k, data_list=data_list, incremental=True, store=config['store'],
+              bidirected=config['bidirected'], batch_size=config['batch_size'],
+              kmer_filter=kmer_filter, partitions=config['partitions'],
+              memory=config['memory'] << 20 if config['memory'] else None)
+    nodes = dbg.kmer_count
+    edges = count_edges(dbg)
+    if config['clean']:
+        dbg.clean()
+    unitigs = dbg.compact()
+    times['build'] = time.perf_counter() - start
+
+    lengths = []
+    timings = {}
+    with tempfile.TemporaryFile('w') as f:
+        for i in range(n_contigs):
+            contig = dbg.get_longest_contig(timings)
+            if contig is None:
+                break
+            start = time.perf_counter()
+            f.write('>contig_%d\n%s\n' % (i, contig))
+            times['write'] += time.perf_counter() - start
+            lengths.append(len(contig))
+    times['search'] = timings.get('search', 0.0)
+    times['delete'] = timings.get('delete', 0.0)
+    times['write'] += timings.get('concat', 0.0)
+
+    times['total'] = sum(times.values())
+    return {
+        'times': times,
+        # ru_maxrss is in KB on Linux and in bytes on macOS
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        / (1024 * 1024 if sys.platform == 'darwin' else 1024),
+        'nodes': nodes,
+        'edges': edges,
+        'unitigs': unitigs,
+        'n50': compute_n50(lengths) if lengths else 0,
+    }
+
+
+def benchmark(config, datasets, repeat):
+    results = {}
+    for dataset in datasets:
+        runs = []
+        for _ in range(repeat):
+            # a fresh process per run keeps peak RSS and caches independent
+            with multiprocessing.Pool(1, maxtasksperchild=1) as pool:
+                runs.append(pool.apply(run_once, (dict(config, dataset=dataset),)))
+        summary = {phase: statistics.median(run['times'][phase] for run in runs)
+                   for phase in PHASES + ['total']}
+        results[dataset] = {
+            'median': summary,
+            'peak_rss_mb': max(run['peak_rss_mb'] for run in runs),
+            'nodes': runs[0]['nodes'],
+            'edges': runs[0]['edges'],
+            'unitigs': runs[0]['unitigs'],
+            'n50': runs[0]['n50'],
+            'runs': runs,
+        }
+        print('%s\t%s\trss %.0f MB\tnodes %d\tunitigs %d\tN50 %d' % (
+            dataset, '  '.join('%s %.3fs' % (phase, summary[phase]) for phase in PHASES + ['total']),
+            results[dataset]['peak_rss_mb'], runs[0]['nodes'], runs[0]['unitigs'], runs[0]['n50']))
+    return results
+
+
+def compare(results, baseline, tolerance, min_seconds=0.05):
+    """Return a message for every measurement that regressed against baseline."""
+    regressions = []
+    for dataset, result in results.items():
+        if dataset not in baseline:
+            continue
+        base = baseline[dataset]
+        for phase in PHASES + ['total']:
+            new, old = result['median'][phase], base['median'][phase]
+            # tiny phases are all noise, so they need an absolute change too
+            if new > old * (1 + tolerance) and new - old > min_seconds:
+                regressions.append('%s %s: %.3fs -> %.3fs' % (dataset, phase, old, new))
+        new, old = result['peak_rss_mb'], base['peak_rss_mb']
+        if new > old * (1 + tolerance):
+            regressions.append('%s peak RSS: %.0f MB -> %.0f MB' % (dataset, old, new))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the DBG assembler.')
+    parser.add_argument('datasets', nargs='*', default=['data1', 'data2', 'data3', 'data4'])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--contigs', type=int, default=20)
+    parser.add_argument('-k', type=int, default=25)
+    parser.add_argument('--reader', choices=['stream', 'mmap', 'list'], default='stream')
+    parser.add_argument('--store', choices=['array', 'dict'], default='array')
+    parser.add_argument('--bidirected', action='store_true')
+    parser.add_argument('--batch-size', type=int, default=0)
+    parser.add_argument('--min-count', type=int, default=1)
+    parser.add_argument('--filter-memory', type=int, default=64, help='filter size in MB')
+    parser.add_argument('--partitions', type=int, default=0)
+    parser.add_argument('--memory', type=int, default=None, help='memory limit in MB')
+    parser.add_argument('--clean', action='store_true')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed relative growth of a median time or of peak RSS')
+    args = parser.parse_args()
+
+    config = {'k': args.k, 'contigs': args.contigs, 'reader': args.reader,
+              'store': args.store, 'bidirected': args.bidirected,
+              'batch_size': args.batch_size, 'min_count': args.min_count,
+              'filter_memory': args.filter_memory, 'partitions': args.partitions,
+              'memory': args.memory, 'clean': args.clean}
+    results = benchmark(config, args.datasets, args.repeat)
+    report = {'config': dict(config, repeat=args.repeat, python=platform.python_version()),
+              'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline['results'], args.tolerance)
+        for message in regressions:
+            print('REGRESSION', message)
+        if regressions:
+            sys.exit(1)
+        print('No regressions against', args.baseline)
+
+
+if __name__ == '__main__':
+    main()
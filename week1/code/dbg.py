@@ -1,10 +1,24 @@
-import copy
+import collections
+import heapq
+import itertools
+import multiprocessing
+import time
+from array import array
+from node_store import NodeStore, BidirectedStore
+from kmer_filter import mix
+import snapshot
 # Make matplotlib optional
 try:
     from matplotlib import pyplot as plt
     HAS_MATPLOTLIB = True
 except ImportError:
     HAS_MATPLOTLIB = False
+# batch counting needs NumPy
+try:
+    import batch_count
+    HAS_NUMPY = True
+except ImportError:
+    HAS_NUMPY = False
 
 
 def reverse_complement(key):
@@ -16,10 +30,187 @@ def reverse_complement(key):
     return ''.join(key)
 
 
+# k-mers are packed two bits per base (A=0, C=1, G=2, T=3), so at k <= 32 a
+# k-mer fits in one 64-bit integer and the complement of a code is 3 - code.
+BASES = 'ACGT'
+_BASE_CODE = {}
+for _code, _base in enumerate(BASES):
+    for _key in (_base, _base.lower()):
+        _BASE_CODE[_key] = _code
+        _BASE_CODE[ord(_key)] = _code
+
+
+def encode_kmer(kmer):
+    code = 0
+    for base in kmer:
+        code = (code << 2) | _BASE_CODE[base]
+    return code
+
+
+def decode_kmer(code, k):
+    bases = []
+    for _ in range(k):
+        bases.append(BASES[code & 3])
+        code >>= 2
+    return ''.join(reversed(bases))
+
+
+def reverse_complement_code(code, k):
+    rc = 0
+    for _ in range(k):
+        rc = (rc << 2) | (3 - (code & 3))
+        code >>= 2
+    return rc
+
+
+def canonical_kmer(code, k):
+    return min(code, reverse_complement_code(code, k))
+
+
+def kmer_codes(seq, k):
+    """Return the packed codes of every k-mer in seq and of their reverse complements.
+
+    Both lists are indexed by the k-mer's start position on the forward strand,
+    so rc_codes[i] is the reverse complement of fwd_codes[i]. The codes are
+    updated in a rolling fashion as the window slides, one base at a time.
+    seq may be a str or any bytes-like object.
+    """
+    mask = (1 << (2 * k)) - 1
+    shift = 2 * (k - 1)
+    fwd_codes, rc_codes = [], []
+    fwd = rc = 0
+    for i, base in enumerate(seq):
+        code = _BASE_CODE[base]
+        fwd = ((fwd << 2) | code) & mask
+        rc = (rc >> 2) | ((3 - code) << shift)
+        if i >= k - 1:
+            fwd_codes.append(fwd)
+            rc_codes.append(rc)
+    return fwd_codes, rc_codes
+
+
+def read_arcs(read, k, kmer_filter=None, known=None):
+    """Yield the (kmer1, kmer2) arcs of one read in the order DBG inserts them.
+
+    Arcs along the read and along its reverse complement alternate. With a
+    kmer_filter, the k-mers it does not admit (and that are not in known) are
+    replaced with None.
+    """
+    fwd, rc = kmer_codes(read, k)
+    if kmer_filter is not None and len(fwd) > 2:
+        # the last forward and first reverse complement k-mer are on no arc
+        fwd[:-1] = kmer_filter.admit(fwd[:-1], known)
+        rc[1:] = kmer_filter.admit(rc[1:], known)
+    # the i-th k-mer of the reverse complement read is rc[last - i]
+    last = len(fwd) - 1
+    for i in range(len(read) - k - 1):
+        yield fwd[i], fwd[i + 1]
+        yield rc[last - i], rc[last - i - 1]
+
+
+def canonical_arcs(read, k, kmer_filter=None, known=None):
+    """Yield the arcs of one read as (kmer1, bit1, kmer2, bit2) over canonical k-mers.
+
+    kmer1 and kmer2 are the canonical codes of the two ends of an arc along
+    the read. bit1 is the child bit the arc sets on kmer1 and bit2 the one its
+    reverse complement sets on kmer2: bits 0-3 stand for the base appended to
+    the canonical strand of a k-mer, bits 4-7 for the base appended to the
+    other strand. The reverse complement read is never walked, so every arc
+    along the read is kept: between them, the two strands of read_arcs cover
+    all k-mers of the read too. As in read_arcs, k-mers a kmer_filter does not
+    admit are None, and then the arc sets no bits.
+    """
+    fwd, rc = kmer_codes(read, k)
+    admitted = None
+    if kmer_filter is not None and len(fwd) > 1:
+        admitted = kmer_filter.admit(list(map(min, fwd, rc)), known)
+    for i in range(len(fwd) - 1):
+        kmer1, rc1, kmer2, rc2 = fwd[i], rc[i], fwd[i + 1], rc[i + 1]
+        if kmer1 <= rc1:
+            bit1 = 1 << (kmer2 & 3)
+        else:
+            kmer1, bit1 = rc1, 16 << (kmer2 & 3)
+        # the reverse complement arc runs from rc2 to rc1
+        if kmer2 <= rc2:
+            bit2 = 16 << (rc1 & 3)
+        else:
+            kmer2, bit2 = rc2, 1 << (rc1 & 3)
+        if admitted is not None and (admitted[i] is None or admitted[i + 1] is None):
+            kmer1, kmer2 = admitted[i], admitted[i + 1]
+            bit1 = bit2 = 0
+        yield kmer1, bit1, kmer2, bit2
+
+
+def _count_shard(job):
+    """Count the k-mers and arcs of one shard of reads, split by k-mer partition.
+
+    Each partition is returned as columns (kmers, counts, firsts, children),
+    which are far smaller to ship around than a dict, and k-mers are assigned
+    to partitions by hash. first is the index of the k-mer's first insertion,
+    packed with the shard as shard << 40 | index, so merged tables can recover
+    the order a serial build would have seen the k-mers in. The child of an
+    arc differs from its parent only by the appended base, so children are
+    kept as a 4-bit mask over that base, or as the 8-bit mask of
+    canonical_arcs when bidirected is set.
+    """
+    k, reads, shard, n_partitions, bidirected = job
+    table = {}
+    n = shard << 40
+    for read in reads:
+        if bidirected:
+            arcs = canonical_arcs(read, k)
+        else:
+            arcs = ((kmer1, 1 << (kmer2 & 3), kmer2, 0) for kmer1, kmer2 in read_arcs(read, k))
+        for kmer1, bit1, kmer2, bit2 in arcs:
+            for kmer, bit in ((kmer1, bit1), (kmer2, bit2)):
+                entry = table.get(kmer)
+                if entry is None:
+                    table[kmer] = [1, n, bit]
+                else:
+                    entry[0] += 1
+                    entry[2] |= bit
+                n += 1
+    partitions = [(array('Q'), array('I'), array('Q'), bytearray()) for _ in range(n_partitions)]
+    for kmer, (count, first, children) in table.items():
+        kmers, counts, firsts, masks = partitions[mix(kmer) % n_partitions]
+        kmers.append(kmer)
+        counts.append(count)
+        firsts.append(first)
+        masks.append(children)
+    return partitions
+
+
+def _merge_partition(tables):
+    """Merge the column tables of one partition, given in shard order.
+
+    The first entry seen of a k-mer keeps its position, so when the tables
+    are sorted by first, so is the result.
+    """
+    index = {}
+    kmers, counts, firsts, masks = array('Q'), array('I'), array('Q'), bytearray()
+    for table in tables:
+        for kmer, count, first, children in zip(*table):
+            row = index.get(kmer)
+            if row is None:
+                index[kmer] = len(kmers)
+                kmers.append(kmer)
+                counts.append(count)
+                firsts.append(first)
+                masks.append(children)
+            else:
+                counts[row] += count
+                masks[row] |= children
+    return kmers, counts, firsts, masks
+
+
 class Node:
-    def __init__(self, kmer):
+    # number of k-mers the node stands for
+    length = 1
+
+    def __init__(self, kmer, count=0):
         self._children = set()
-        self._count = 0
+        self._parents = set()
+        self._count = count
         self.kmer = kmer
         self.visited = False
         self.depth = 0
@@ -28,6 +219,9 @@ class Node:
     def add_child(self, kmer):
         self._children.add(kmer)
 
+    def add_parent(self, kmer):
+        self._parents.add(kmer)
+
     def increase(self):
         self._count += 1
 
@@ -39,41 +233,311 @@ class Node:
     def get_count(self):
         return self._count
 
+    @property
+    def coverage(self):
+        return self._count
+
     def get_children(self):
         return list(self._children)
 
+    def get_parents(self):
+        return list(self._parents)
+
+    def get_in_degree(self):
+        return len(self._parents)
+
+    def get_out_degree(self):
+        return len(self._children)
+
     def remove_children(self, target):
         self._children = self._children - target
 
+    def remove_child(self, kmer):
+        self._children.discard(kmer)
+
+    def remove_parent(self, kmer):
+        self._parents.discard(kmer)
+
+
+class Unitig(Node):
+    """A maximal non-branching path of k-mers collapsed into one node.
+
+    kmer is the packed code of the first k-mer, so the unitig sorts among its
+    siblings exactly like that k-mer did, and its count is that k-mer's count.
+    coverage is the mean count over all of its k-mers.
+    """
+
+    def __init__(self, kmer, count, sequence, length, coverage):
+        super().__init__(kmer, count)
+        self.sequence = sequence
+        self.length = length
+        self._coverage = coverage
+
+    @property
+    def coverage(self):
+        return self._coverage
+
 
 class DBG:
-    def __init__(self, k, data_list):
+    def __init__(self, k, data_list, incremental=False, workers=1, shard_size=2000,
+                 store='dict', bidirected=False, batch_size=0, kmer_filter=None,
+                 partitions=0, memory=None, tmpdir=None):
         self.k = k
         self.nodes = {}
+        # with incremental=True, depths are computed once and then only
+        # refreshed for the ancestors of each deleted path
+        self.incremental = incremental
+        # 'dict' keeps a Node object per k-mer, 'array' a compact NodeStore
+        self.store = store
+        # with bidirected=True a k-mer and its reverse complement share one
+        # node of a BidirectedStore, and node ids are oriented
+        self.bidirected = bidirected
+        # with batch_size > 0 reads are counted with NumPy, in blocks of about
+        # that many bases, into the same graph as a serial build
+        self.batch_size = batch_size
+        # with partitions > 0 the batch counts go through that many bucket
+        # files under tmpdir, and no more than about memory bytes are used
+        # while counting, for inputs whose k-mers do not fit in memory
+        self.partitions = partitions
         # private
         self.kmer2idx = {}
         self.kmer_count = 0
+        # k-mers that passed a KmerFilter were counted there before they got a
+        # node; each of those occurrences stands for two insertions
+        self._initial_count = 0
+        self.compacted = False
+        self._depth_heap = None
         # build
         self._check(data_list)
-        self._build(data_list)
+        if kmer_filter is not None:
+            assert workers == 1
+            self._initial_count = 2 * (kmer_filter.min_count - 1)
+        if batch_size > 0:
+            self._build_batch(data_list, batch_size, kmer_filter, memory, tmpdir)
+        elif workers > 1:
+            self._build_parallel(data_list, workers, shard_size)
+        elif bidirected:
+            self._build_bidirected(data_list, kmer_filter)
+        elif store == 'array':
+            self._build_columns(data_list, kmer_filter)
+        else:
+            self._build(data_list, kmer_filter)
 
     def _check(self, data_list):
-        # check data list
+        # check data list; streamed reads can only be checked as they arrive
+        assert self.store in ('dict', 'array')
+        # at odd k no k-mer is its own reverse complement
+        assert not self.bidirected or (self.store == 'array' and self.k % 2 == 1)
+        # arcs are counted as (k+1)-mers in 64-bit words
+        assert not self.batch_size or (HAS_NUMPY and self.store == 'array' and self.k < 32)
+        assert not self.partitions or self.batch_size
         assert len(data_list) > 0
-        assert self.k <= len(data_list[0][0])
+        if isinstance(data_list[0], list):
+            assert self.k <= len(data_list[0][0])
 
-    def _build(self, data_list):
+    def _build(self, data_list, kmer_filter=None):
         for data in data_list:
             for original in data:
-                rc = reverse_complement(original)
-                for i in range(len(original) - self.k - 1):
-                    self._add_arc(original[i: i + self.k], original[i + 1: i + 1 + self.k])
-                    self._add_arc(rc[i: i + self.k], rc[i + 1: i + 1 + self.k])
+                for kmer1, kmer2 in read_arcs(original, self.k, kmer_filter, self.kmer2idx):
+                    if kmer1 is None or kmer2 is None:
+                        # only the admitted end of the arc is counted
+                        for kmer in (kmer1, kmer2):
+                            if kmer is not None:
+                                self._add_node(kmer)
+                    else:
+                        self._add_arc(kmer1, kmer2)
 
-    def show_count_distribution(self):
-        count = [0] * 30
+    def _build_parallel(self, data_list, workers, shard_size):
+        """Build the same graph as _build with a pool of worker processes.
+
+        Reads are cut into shards of shard_size reads. Each worker counts the
+        k-mers and arcs of a shard into one partial table per k-mer partition
+        (by hash, one per worker). The partials of each partition are merged
+        into a running table by a pool task of their own, whenever they have
+        grown as large as the running tables, so merging runs in parallel too
+        and the partials held at a time stay bounded. Node ids are then handed
+        out in first-seen order.
+        """
+        # memory-mapped reads cannot be pickled, so they are copied here
+        reads = (bytes(read) if isinstance(read, memoryview) else read for read in
+                 itertools.chain.from_iterable(data_list))
+        batches = iter(lambda: list(itertools.islice(reads, shard_size)), [])
+        jobs = ((self.k, batch, shard, workers, self.bidirected)
+                for shard, batch in enumerate(batches))
+        merged = [[] for _ in range(workers)]
+        partials = [[] for _ in range(workers)]
+        merged_size = partial_size = 0
+        with multiprocessing.Pool(workers) as pool:
+            # only a few shards are in flight at a time, so queued reads do
+            # not grow with the input
+            in_flight = collections.deque()
+            for job in itertools.chain(jobs, [None]):
+                if job is not None:
+                    in_flight.append(pool.apply_async(_count_shard, (job,)))
+                while len(in_flight) > 2 * workers or (job is None and in_flight):
+                    # shards are collected in order, so partials stay in shard order
+                    for p, table in enumerate(in_flight.popleft().get()):
+                        partials[p].append(table)
+                        partial_size += len(table[0])
+                if partial_size and (partial_size >= merged_size or job is None):
+                    merged = pool.map(_merge_partition,
+                                      [tables + partial for tables, partial in zip(merged, partials)])
+                    merged = [[table] for table in merged]
+                    merged_size = sum(len(tables[0][0]) for tables in merged)
+                    partials = [[] for _ in range(workers)]
+                    partial_size = 0
+
+        kmers, counts, firsts, child_masks = array('Q'), array('I'), array('Q'), bytearray()
+        for tables in merged:
+            for partition_kmers, partition_counts, partition_firsts, masks in tables:
+                kmers.extend(partition_kmers)
+                counts.extend(partition_counts)
+                firsts.extend(partition_firsts)
+                child_masks.extend(masks)
+        del merged
+        # every partition is sorted by first already, which the sort picks up
+        order = sorted(range(len(kmers)), key=firsts.__getitem__)
+        del firsts
+        kmers = array('Q', map(kmers.__getitem__, order))
+        counts = array('I', map(counts.__getitem__, order))
+        child_masks = bytearray(map(child_masks.__getitem__, order))
+        del order
+        self.kmer2idx = dict(zip(kmers, range(len(kmers))))
+        self._load_columns(kmers, counts, child_masks)
+
+    def _build_columns(self, data_list, kmer_filter=None):
+        # same counting as _build, into per-node columns instead of Node objects
+        kmers, counts, child_masks = array('Q'), array('I'), bytearray()
+        for data in data_list:
+            for original in data:
+                for kmer1, kmer2 in read_arcs(original, self.k, kmer_filter, self.kmer2idx):
+                    for kmer in (kmer1, kmer2):
+                        if kmer is None:
+                            continue
+                        idx = self.kmer2idx.get(kmer)
+                        if idx is None:
+                            idx = self.kmer2idx[kmer] = len(kmers)
+                            kmers.append(kmer)
+                            counts.append(self._initial_count)
+                            child_masks.append(0)
+                        counts[idx] += 1
+                    if kmer1 is not None and kmer2 is not None:
+                        child_masks[self.kmer2idx[kmer1]] |= 1 << (kmer2 & 3)
+        self._load_columns(kmers, counts, child_masks)
+
+    def _build_batch(self, data_list, batch_size, kmer_filter=None, memory=None, tmpdir=None):
+        # counting, node ids and adjacency all happen in batch_count, so the
+        # store is built without kmer2idx
+        reads = itertools.chain.from_iterable(data_list)
+        options = dict(kmer_filter=kmer_filter, partitions=self.partitions, memory=memory,
+                       tmpdir=tmpdir)
+        if self.bidirected:
+            columns = batch_count.build_bidirected_columns(reads, self.k, batch_size, **options)
+            self.nodes = BidirectedStore.from_adjacency(self.k, *columns)
+        else:
+            columns = batch_count.build_columns(reads, self.k, batch_size, **options)
+            self.nodes = NodeStore.from_adjacency(*columns)
+        self.kmer_count = len(self.nodes.kmers)
+
+    def _build_bidirected(self, data_list, kmer_filter=None):
+        # like _build_columns, over canonical k-mers and the forward strand only
+        kmers, counts, child_masks = array('Q'), array('I'), bytearray()
+        for data in data_list:
+            for original in data:
+                arcs = canonical_arcs(original, self.k, kmer_filter, self.kmer2idx)
+                for kmer1, bit1, kmer2, bit2 in arcs:
+                    for kmer, bit in ((kmer1, bit1), (kmer2, bit2)):
+                        if kmer is None:
+                            continue
+                        idx = self.kmer2idx.get(kmer)
+                        if idx is None:
+                            idx = self.kmer2idx[kmer] = len(kmers)
+                            kmers.append(kmer)
+                            counts.append(self._initial_count)
+                            child_masks.append(0)
+                        counts[idx] += 1
+                        child_masks[idx] |= bit
+        self._load_columns(kmers, counts, child_masks)
+
+    def _load_columns(self, kmers, counts, child_masks):
+        """Create the nodes from per-node columns indexed by node id.
+
+        child_masks[idx] has bit b set when the k-mer extended by base b is a
+        child of idx; kmer2idx must already map every k-mer to its id. In a
+        bidirected graph the columns are per canonical k-mer, with the 8-bit
+        child masks of canonical_arcs.
+        """
+        self.kmer_count = len(kmers)
+        if self.bidirected:
+            self.nodes = BidirectedStore(self.k, kmers, counts, child_masks, self.kmer2idx)
+            self.kmer2idx = {}
+            return
+        if self.store == 'array':
+            self.nodes = NodeStore(self.k, kmers, counts, child_masks, self.kmer2idx)
+            # the store does not need it, and it is most of the memory
+            self.kmer2idx = {}
+            return
+        for idx in range(len(kmers)):
+            self.nodes[idx] = Node(kmers[idx], counts[idx])
+        mask = (1 << (2 * self.k)) - 1
+        for idx1 in range(len(kmers)):
+            for base in range(4):
+                if child_masks[idx1] >> base & 1:
+                    idx2 = self.kmer2idx[((kmers[idx1] << 2) | base) & mask]
+                    self.nodes[idx1].add_child(idx2)
+                    self.nodes[idx2].add_parent(idx1)
+
+    def save(self, path, checksum=b''):
+        """Write the graph to a snapshot file that load can map back.
+
+        Only a freshly built array-store graph can be saved, before it is
+        cleaned, compacted or searched; anything else raises ValueError.
+        checksum identifies the input, so that load can reject a snapshot of
+        other reads (see utils.data_checksum).
+        """
+        if self.store != 'array':
+            raise ValueError('only graphs with the array store can be saved')
+        if self.compacted or self.nodes.alive.count(0):
+            raise ValueError('the graph was compacted or had nodes removed')
+        columns = {name: getattr(self.nodes, name) for name, _ in snapshot.COLUMNS
+                   if hasattr(self.nodes, name)}
+        snapshot.write_snapshot(path, self.k, self.bidirected, checksum, columns)
+
+    @classmethod
+    def load(cls, path, checksum=None, incremental=False):
+        """Return the graph saved at path, with its columns mapped from the file.
+
+        Raises ValueError when checksum is given and the snapshot was saved
+        with another one, or when path is not a snapshot.
+        """
+        k, bidirected, columns = snapshot.read_snapshot(path, checksum)
+        dbg = cls.__new__(cls)
+        dbg.k = k
+        dbg.incremental = incremental
+        dbg.store = 'array'
+        dbg.bidirected = bidirected
+        dbg.batch_size = 0
+        dbg.partitions = 0
+        dbg.kmer2idx = {}
+        dbg._initial_count = 0
+        dbg.compacted = False
+        dbg._depth_heap = None
+        if bidirected:
+            dbg.nodes = BidirectedStore.from_adjacency(k, *columns.values())
+        else:
+            dbg.nodes = NodeStore.from_adjacency(*columns.values())
+        dbg.kmer_count = len(columns['kmers'])
+        return dbg
+
+    def get_count_distribution(self, max_count=30):
+        # counts of max_count - 1 and above share the last bin
+        count = [0] * max_count
         for idx in self.nodes:
-            count[self.nodes[idx].get_count()] += 1
+            count[min(self.nodes[idx].get_count(), max_count - 1)] += 1
+        return count
+
+    def show_count_distribution(self):
+        count = self.get_count_distribution()
         print(count[0:10])
         # Only plot if matplotlib is available
         # if HAS_MATPLOTLIB:
@@ -83,7 +547,7 @@ class DBG:
     def _add_node(self, kmer):
         if kmer not in self.kmer2idx:
             self.kmer2idx[kmer] = self.kmer_count
-            self.nodes[self.kmer_count] = Node(kmer)
+            self.nodes[self.kmer_count] = Node(kmer, self._initial_count)
             self.kmer_count += 1
         idx = self.kmer2idx[kmer]
         self.nodes[idx].increase()
@@ -93,25 +557,226 @@ class DBG:
         idx1 = self._add_node(kmer1)
         idx2 = self._add_node(kmer2)
         self.nodes[idx1].add_child(idx2)
+        self.nodes[idx2].add_parent(idx1)
+
+    def _extends_parent(self, idx):
+        # idx is the only child of its only parent, so both sit on one unitig
+        if self.nodes[idx].get_in_degree() != 1:
+            return False
+        parent = self.nodes[idx].get_parents()[0]
+        return parent != idx and self.nodes[parent].get_out_degree() == 1
+
+    def _walk_unitig(self, start, owner):
+        chain = [start]
+        owner[start] = start
+        idx = start
+        while self.nodes[idx].get_out_degree() == 1:
+            child = self.nodes[idx].get_children()[0]
+            if child in owner or not self._extends_parent(child):
+                break
+            chain.append(child)
+            owner[child] = start
+            idx = child
+        return chain
+
+    def _add_twin_chain(self, chains, owner):
+        # the other strand of the last chain is a unitig of its own, unless the
+        # chain is its own reverse complement
+        if not self.bidirected:
+            return
+        twin = [self.nodes[idx].twin for idx in reversed(chains[-1])]
+        if twin[0] in owner:
+            return
+        for idx in twin:
+            owner[idx] = twin[0]
+        chains.append(twin)
+
+    def compact(self):
+        """Collapse every maximal non-branching path into a single Unitig node.
+
+        A unitig keeps the id of its first k-mer. Depths count k-mers, so the
+        longest path and the contigs are the same as on the uncompacted graph,
+        while path search and deletion touch far fewer nodes. The graph can no
+        longer be extended with reads afterwards. An already compacted graph can
+        be compacted again after nodes were removed from it. Returns the number
+        of unitigs.
+
+        In a bidirected graph the unitigs come in twin pairs, one per strand,
+        and each knows the id of its twin.
+        """
+        owner = {}
+        chains = []
+        for idx in self.nodes:
+            if idx not in owner and not self._extends_parent(idx):
+                chains.append(self._walk_unitig(idx, owner))
+                self._add_twin_chain(chains, owner)
+        # whatever is left lies on isolated cycles; start them at their smallest id
+        for idx in self.nodes:
+            if idx not in owner:
+                chains.append(self._walk_unitig(idx, owner))
+                self._add_twin_chain(chains, owner)
+        chains.sort(key=lambda chain: chain[0])
+
+        unitigs = {}
+        for chain in chains:
+            head, tail = self.nodes[chain[0]], self.nodes[chain[-1]]
+            lengths = [self.nodes[idx].length for idx in chain]
+            coverage = sum(self.nodes[idx].coverage * length
+                           for idx, length in zip(chain, lengths)) / sum(lengths)
+            unitig = Unitig(head.kmer, head.get_count(), self._concat_path(chain),
+                            sum(lengths), coverage)
+            for child in tail.get_children():
+                unitig.add_child(owner[child])
+            for parent in head.get_parents():
+                unitig.add_parent(owner[parent])
+            if self.bidirected:
+                unitig.twin = owner[tail.twin]
+            unitigs[chain[0]] = unitig
+        self.nodes = unitigs
+        self.kmer2idx = {}
+        self.compacted = True
+        self._depth_heap = None
+        return len(unitigs)
+
+    def solid_cutoff(self, max_count=1000):
+        """Return the lowest count of a solid k-mer, read off the count histogram.
+
+        A k-mer inside a read is counted twice per occurrence, as the end of
+        one arc and the start of the next, so the histogram is taken over
+        occurrences, (count + 1) // 2. Erroneous k-mers make a peak at one
+        occurrence; solid ones start at the first valley after it.
+        """
+        count = self.get_count_distribution(max_count)
+        occurrences = [0] * (max_count // 2 + 1)
+        for c in range(1, max_count):
+            occurrences[(c + 1) // 2] += count[c]
+        for occ in range(1, len(occurrences) - 1):
+            if occurrences[occ + 1] > occurrences[occ]:
+                return 2 * occ - 1
+        return 1
+
+    def remove_low_coverage(self, cutoff):
+        low = [idx for idx in self.nodes if self.nodes[idx].coverage < cutoff]
+        self._delete_path(low)
+        return len(low)
+
+    def clip_tips(self, max_length):
+        """Remove dead-end unitigs shorter than max_length k-mers.
+
+        A tip has no parents and joins a node with other parents, or has no
+        children and leaves a node with other children.
+        """
+        if not self.compacted:
+            self.compact()
+        tips = []
+        for idx in self.nodes:
+            node = self.nodes[idx]
+            if node.length >= max_length:
+                continue
+            if node.get_in_degree() == 0 and node.get_out_degree() == 1:
+                child = node.get_children()[0]
+                if child != idx and self.nodes[child].get_in_degree() > 1:
+                    tips.append(idx)
+            elif node.get_out_degree() == 0 and node.get_in_degree() == 1:
+                parent = node.get_parents()[0]
+                if parent != idx and self.nodes[parent].get_out_degree() > 1:
+                    tips.append(idx)
+        self._delete_path(tips)
+        return len(tips)
+
+    def pop_bubbles(self, max_length):
+        """Collapse simple bubbles whose branches are at most max_length k-mers.
+
+        A simple bubble is two or more unitigs that share their only parent and
+        their only child. The branch with the highest mean coverage is kept.
+        """
+        if not self.compacted:
+            self.compact()
+        popped = []
+        for idx in self.nodes:
+            if self.nodes[idx].get_out_degree() < 2:
+                continue
+            branches = {}
+            for child in sorted(self.nodes[idx].get_children()):
+                node = self.nodes[child]
+                if node.length > max_length or node.get_in_degree() != 1 \
+                        or node.get_out_degree() != 1:
+                    continue
+                end = node.get_children()[0]
+                if end != idx and end != child:
+                    branches.setdefault(end, []).append(child)
+            for group in branches.values():
+                if len(group) > 1:
+                    if self.bidirected:
+                        # the twin bubble on the other strand keeps the same branch
+                        group.sort(key=lambda child: min(child, self.nodes[child].twin))
+                    group.sort(key=lambda child: self.nodes[child].coverage, reverse=True)
+                    popped.extend(group[1:])
+        self._delete_path(popped)
+        return len(popped)
+
+    def clean(self, cutoff=None, max_tip=None, max_bubble=None):
+        """Remove likely sequencing errors from the graph before path search.
+
+        Drops k-mers below cutoff (solid_cutoff() by default) and compacts the
+        graph, then clips tips shorter than max_tip k-mers (k by default), pops
+        bubbles of at most max_bubble k-mers (2k by default) and compacts again.
+        Returns how many nodes each step removed.
+        """
+        if cutoff is None:
+            cutoff = self.solid_cutoff()
+        removed = {'low_coverage': self.remove_low_coverage(cutoff)}
+        self.compact()
+        removed['tips'] = self.clip_tips(self.k if max_tip is None else max_tip)
+        removed['bubbles'] = self.pop_bubbles(2 * self.k if max_bubble is None else max_bubble)
+        self.compact()
+        return removed
 
     def _get_count(self, child):
         return self.nodes[child].get_count()
 
     def _get_sorted_children(self, idx):
-        children = self.nodes[idx].get_children()
+        # ties on count go to the older node, so the order does not depend on
+        # set iteration order and survives edge deletions
+        children = sorted(self.nodes[idx].get_children())
         children.sort(key=self._get_count, reverse=True)
         return children
 
     def _get_depth(self, idx):
-        if not self.nodes[idx].visited:
-            self.nodes[idx].visited = True
-            children = self._get_sorted_children(idx)
-            max_depth, max_child = 0, None
-            for child in children:
-                depth = self._get_depth(child)
-                if depth > max_depth:
-                    max_depth, max_child = depth, child
-            self.nodes[idx].depth, self.nodes[idx].max_depth_child = max_depth + 1, max_child
+        """Return the number of k-mers on the longest path starting at idx.
+
+        Depths are computed by a post-order DFS on an explicit stack, so the
+        graph size is not limited by the recursion limit. A child that is still
+        on the stack closes a cycle: that back edge is ignored, which makes the
+        result the longest path in the DAG left after dropping the back edges
+        met by the DFS. Every path followed through max_depth_child is simple.
+        """
+        if self.nodes[idx].visited:
+            return self.nodes[idx].depth
+        self.nodes[idx].visited = True
+        on_stack = {idx}
+        stack = [(idx, self._get_sorted_children(idx), [0])]
+        while stack:
+            top, children, pos = stack[-1]
+            while pos[0] < len(children):
+                child = children[pos[0]]
+                pos[0] += 1
+                if not self.nodes[child].visited:
+                    self.nodes[child].visited = True
+                    on_stack.add(child)
+                    stack.append((child, self._get_sorted_children(child), [0]))
+                    break
+            else:
+                stack.pop()
+                on_stack.discard(top)
+                max_depth, max_child = 0, None
+                for child in children:
+                    if child in on_stack:
+                        continue
+                    depth = self.nodes[child].depth
+                    if depth > max_depth:
+                        max_depth, max_child = depth, child
+                self.nodes[top].depth, self.nodes[top].max_depth_child = max_depth + self.nodes[top].length, max_child
         return self.nodes[idx].depth
 
     def _reset(self):
@@ -124,32 +789,105 @@ class DBG:
             depth = self._get_depth(idx)
             if depth > max_depth:
                 max_depth, max_idx = depth, idx
+        if self.incremental:
+            self._depth_heap = [(-self.nodes[idx].depth, idx) for idx in self.nodes]
+            heapq.heapify(self._depth_heap)
+        return self._follow_path(max_idx)
+
+    def _get_longest_path_incremental(self):
+        # node ids grow in insertion order, so the smallest id among the deepest
+        # nodes is the one the full scan over self.nodes would have picked
+        while self._depth_heap:
+            depth, idx = self._depth_heap[0]
+            if idx in self.nodes and self.nodes[idx].depth == -depth:
+                return self._follow_path(idx)
+            heapq.heappop(self._depth_heap)
+        return []
 
+    def _follow_path(self, idx):
         path = []
-        while max_idx is not None:
-            path.append(max_idx)
-            max_idx = self.nodes[max_idx].max_depth_child
+        while idx is not None:
+            path.append(idx)
+            idx = self.nodes[idx].max_depth_child
         return path
 
     def _delete_path(self, path):
-        for idx in path:
-            del self.nodes[idx]
+        # reverse edges let us detach the path from its neighbours only;
+        # returns the surviving parents of the deleted nodes
+        if self.bidirected:
+            # a path and its reverse complement spell the same sequence
+            path = list(dict.fromkeys(path + [self.nodes[idx].twin for idx in path]))
         path_set = set(path)
-        for idx in self.nodes.keys():
-            self.nodes[idx].remove_children(path_set)
+        parents = set()
+        for idx in path:
+            node = self.nodes[idx]
+            for parent in node.get_parents():
+                if parent not in path_set:
+                    self.nodes[parent].remove_child(idx)
+                    parents.add(parent)
+            for child in node.get_children():
+                if child not in path_set:
+                    self.nodes[child].remove_parent(idx)
+        for idx in path:
+            # both strands of a k-mer go at once in a BidirectedStore
+            if idx in self.nodes:
+                del self.nodes[idx]
+        return parents
+
+    def _update_depths(self, parents):
+        # only nodes that could reach the deleted path can change depth
+        affected = set(parents)
+        frontier = list(parents)
+        while frontier:
+            idx = frontier.pop()
+            for parent in self.nodes[idx].get_parents():
+                if parent not in affected:
+                    affected.add(parent)
+                    frontier.append(parent)
+        for idx in affected:
+            self.nodes[idx].reset()
+        for idx in sorted(affected):
+            self._get_depth(idx)
+            heapq.heappush(self._depth_heap, (-self.nodes[idx].depth, idx))
 
     def _concat_path(self, path):
         if len(path) < 1:
             return None
-        concat = copy.copy(self.nodes[path[0]].kmer)
-        for i in range(1, len(path)):
-            concat += self.nodes[path[i]].kmer[-1]
-        return concat
+        if self.compacted:
+            concat = [self.nodes[path[0]].sequence]
+            for i in range(1, len(path)):
+                concat.append(self.nodes[path[i]].sequence[self.k - 1:])
+        else:
+            concat = [decode_kmer(self.nodes[path[0]].kmer, self.k)]
+            for i in range(1, len(path)):
+                concat.append(BASES[self.nodes[path[i]].kmer & 3])
+        return ''.join(concat)
 
-    def get_longest_contig(self):
+    def _next_path(self):
+        if self.incremental and self._depth_heap is not None:
+            return self._get_longest_path_incremental()
         # reset params in nodes for getting longest path
         self._reset()
-        path = self._get_longest_path()
+        return self._get_longest_path()
+
+    def get_longest_contig(self, timings=None):
+        """Return the contig of the longest path and remove the path from the graph.
+
+        If a timings dict is given, the seconds spent finding the path
+        ('search', including depth updates), spelling it ('concat') and
+        removing it ('delete') are added to its entries.
+        """
+        start = time.perf_counter()
+        path = self._next_path()
+        found = time.perf_counter()
         contig = self._concat_path(path)
-        self._delete_path(path)
+        spelled = time.perf_counter()
+        parents = self._delete_path(path)
+        deleted = time.perf_counter()
+        if self.incremental:
+            self._update_depths(parents)
+        if timings is not None:
+            for phase, seconds in (('search', found - start + time.perf_counter() - deleted),
+                                   ('concat', spelled - found), ('delete', deleted - spelled)):
+                timings[phase] = timings.get(phase, 0.0) + seconds
         return contig
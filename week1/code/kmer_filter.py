@@ -0,0 +1,113 @@
+"""A counting Bloom filter that keeps rare k-mers out of the graph.
+
+Most distinct k-mers of a read set are sequencing errors seen once. When DBG
+is given a KmerFilter, every occurrence of a k-mer that is not a node yet is
+only counted in the filter, and the k-mer becomes a node once the filter has
+seen it min_count times. The filter is a table of one-byte counters: a k-mer
+increments the counters at n_hashes positions, and its count is estimated as
+the smallest of them, so it can be too high but never too low. With
+min_count=2 this answers "seen before" like a plain Bloom filter. Counters
+stop at min_count, so a k-mer that was admitted stays admitted.
+
+Collisions let some rare k-mers in; false_positive_rate() estimates how often
+a k-mer seen once is admitted, from how full the table is.
+"""
+
+# only the array methods, used by batch_count, need NumPy
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+_MASK64 = (1 << 64) - 1
+
+
+def mix(x):
+    """Hash a 64-bit k-mer code with the splitmix64 finalizer.
+
+    Similar k-mers land far apart, so this also spreads k-mers evenly over
+    partitions.
+    """
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return x ^ (x >> 31)
+
+
+class KmerFilter:
+    def __init__(self, memory, min_count=2, n_hashes=3):
+        """Create a filter of memory one-byte counters.
+
+        A k-mer is admitted to the graph on its min_count-th occurrence.
+        """
+        assert memory > 0 and n_hashes > 0
+        # counters are single bytes
+        assert 2 <= min_count <= 255
+        self.size = memory
+        self.min_count = min_count
+        self.n_hashes = n_hashes
+        self.table = bytearray(memory)
+
+    def _positions(self, kmer):
+        h = mix(kmer)
+        h1, h2 = h >> 32, (h & 0xFFFFFFFF) | 1
+        return [(h1 + i * h2) % self.size for i in range(self.n_hashes)]
+
+    def add(self, kmer):
+        """Count one occurrence of kmer; return its estimated count, up to min_count."""
+        table, cap = self.table, self.min_count
+        estimate = cap
+        for pos in self._positions(kmer):
+            count = table[pos]
+            if count < cap:
+                count += 1
+                table[pos] = count
+            if count < estimate:
+                estimate = count
+        return estimate
+
+    def admit(self, kmers, known):
+        """Count the occurrences in kmers, and replace those not admitted with None.
+
+        k-mers in known are nodes already and are not counted again.
+        """
+        cap = self.min_count
+        return [kmer if kmer in known or self.add(kmer) >= cap else None for kmer in kmers]
+
+    def _array_positions(self, kmers):
+        # the positions of _positions for every k-mer, one row per hash
+        x = kmers.astype(np.uint64)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        x ^= x >> np.uint64(31)
+        h1, h2 = x >> np.uint64(32), (x & np.uint64(0xFFFFFFFF)) | np.uint64(1)
+        return np.stack([(h1 + np.uint64(i) * h2) % np.uint64(self.size)
+                         for i in range(self.n_hashes)])
+
+    def estimate(self, kmers):
+        """Return the estimated counts of an array of k-mers, up to min_count."""
+        table = np.frombuffer(self.table, dtype=np.uint8)
+        return table[self._array_positions(kmers)].min(axis=0)
+
+    def add_counts(self, kmers, counts):
+        """Count counts[i] occurrences of kmers[i]; return the estimates before."""
+        table = np.frombuffer(self.table, dtype=np.uint8)
+        positions = self._array_positions(kmers)
+        before = table[positions].min(axis=0)
+        if len(kmers) == 0:
+            return before
+        # positions shared by several k-mers get the sum of their counts
+        positions = positions.ravel()
+        order = np.argsort(positions)
+        positions = positions[order]
+        heads = np.flatnonzero(np.concatenate([[True], positions[1:] != positions[:-1]]))
+        added = np.add.reduceat(np.tile(counts, self.n_hashes)[order], heads)
+        positions = positions[heads]
+        table[positions] = np.minimum(table[positions] + added, self.min_count)
+        return before
+
+    def false_positive_rate(self):
+        """Estimate the chance that a k-mer seen only once is admitted."""
+        # every counter of such a k-mer must already have reached min_count - 1
+        full = sum(self.table.count(bytes([count]))
+                   for count in range(self.min_count - 1, self.min_count + 1))
+        return (full / self.size) ** self.n_hashes
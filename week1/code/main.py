@@ -1,22 +1,89 @@
-from dbg import DBG
-from utils import read_data
-import sys
+from dbg import DBG, HAS_NUMPY
+from kmer_filter import KmerFilter
+from utils import read_data, stream_data, mmap_reads, data_checksum, build_settings
+import argparse
 import os
 import time
 from n50 import parse_fasta_lengths, compute_n50  # <-- import functions
 
-sys.setrecursionlimit(1000000)
-
 
 if __name__ == "__main__":
     total_start_time = time.time()
-    argv = sys.argv
-    short1, short2, long1 = read_data(os.path.join('../data/', argv[1]))
-
+    parser = argparse.ArgumentParser()
+    parser.add_argument('dataset')
+    parser.add_argument('--reader', choices=['stream', 'mmap', 'list'], default='stream',
+                        help='stream FASTA lines, scan memory-mapped files, or load whole files')
+    parser.add_argument('--store', choices=['array', 'dict'], default='array',
+                        help='keep k-mer nodes in compact arrays or as Node objects')
+    parser.add_argument('--bidirected', action='store_true',
+                        help='keep a k-mer and its reverse complement in one node (needs --store array)')
+    parser.add_argument('--batch-size', type=int, default=2**18,
+                        help='count k-mers with NumPy in blocks of this many bases; '
+                             '0 counts them one at a time (array store only)')
+    parser.add_argument('--min-count', type=int, default=1,
+                        help='leave out k-mers seen fewer times than this, using a Bloom filter')
+    parser.add_argument('--filter-memory', type=int, default=64,
+                        help='size of the --min-count filter in MB')
+    parser.add_argument('--partitions', type=int, default=0,
+                        help='count k-mers through this many bucket files on disk, '
+                             'for inputs too large to count in memory (needs --batch-size)')
+    parser.add_argument('--memory', type=int, default=None,
+                        help='memory limit in MB for counting with --partitions')
+    parser.add_argument('--tmpdir', default=None,
+                        help='directory for the --partitions bucket files')
+    parser.add_argument('--snapshot', default=None,
+                        help='load the graph from this file if it was built from the same reads, '
+                             'else build it and save it there (needs --store array)')
+    parser.add_argument('--clean', action='store_true',
+                        help='drop low-coverage k-mers, tips and bubbles before path search')
+    parser.add_argument('--cutoff', type=int, default=None,
+                        help='lowest k-mer count kept by --clean (default: from the count histogram)')
+    args = parser.parse_args()
+    if args.snapshot is not None and args.store != 'array':
+        parser.error('--snapshot needs --store array')
+    data_path = os.path.join('../data/', args.dataset)
     k = 25
-    dbg = DBG(k=k, data_list=[short1, short2, long1])
+    batch_size = args.batch_size if HAS_NUMPY and args.store == 'array' else 0
+    dbg = None
+    if args.snapshot is not None:
+        # graphs built with other settings must not be reused either; with a
+        # filter, batch and serial builds keep slightly different k-mers
+        settings = build_settings(k=k, store=args.store, bidirected=args.bidirected,
+                                  batch_size=batch_size, min_count=args.min_count,
+                                  filter_memory=args.filter_memory)
+        checksum = data_checksum(data_path, settings)
+        if os.path.exists(args.snapshot):
+            try:
+                dbg = DBG.load(args.snapshot, checksum, incremental=True)
+            except ValueError as e:
+                print('rebuilding:', e)
+            else:
+                print('loaded', args.snapshot)
+    if dbg is None:
+        if args.reader == 'list':
+            short1, short2, long1 = read_data(data_path)
+        elif args.reader == 'mmap':
+            short1, short2, long1 = stream_data(data_path, reader=mmap_reads)
+        else:
+            short1, short2, long1 = stream_data(data_path)
+
+        kmer_filter = None
+        if args.min_count > 1:
+            kmer_filter = KmerFilter(args.filter_memory << 20, args.min_count)
+        memory = args.memory << 20 if args.memory is not None else None
+        dbg = DBG(k=k, data_list=[short1, short2, long1], incremental=True, store=args.store,
+                  bidirected=args.bidirected, batch_size=batch_size, kmer_filter=kmer_filter,
+                  partitions=args.partitions, memory=memory, tmpdir=args.tmpdir)
+        if kmer_filter is not None:
+            print('filter false positive rate %.2g' % kmer_filter.false_positive_rate())
+        if args.snapshot is not None:
+            dbg.save(args.snapshot, checksum)
     # dbg.show_count_distribution()
-    contig_path = os.path.join('../data/', argv[1], 'contig.fasta')
+    n_kmers = dbg.kmer_count
+    if args.clean:
+        print('removed', dbg.clean(cutoff=args.cutoff))
+    print('nodes', n_kmers, 'unitigs', dbg.compact())
+    contig_path = os.path.join(data_path, 'contig.fasta')
     with open(contig_path, 'w') as f:
         for i in range(20):
             c = dbg.get_longest_contig()
@@ -0,0 +1,350 @@
+"""Struct-of-arrays storage for the k-mer nodes of a DBG.
+
+A Node object with its child and parent sets costs several hundred bytes per
+k-mer. NodeStore keeps one array column per node field instead, plus CSR
+adjacency (an offsets column and a flat targets column) for children and for
+parents, built once after counting. Per node it uses:
+
+    kmer (Q) 8 + count (I) 4 + depth (I) 4 + max_depth_child (i) 4
+    + child and parent offsets (I) 4 + 4 + in and out degree 1 + 1
+    + visited and alive flags 1 + 1 = 32 bytes,
+
+plus 4 bytes per child and 4 per parent edge. A k-mer has at most four
+children and four parents, so with the usual one or two edges a node costs
+40-48 bytes. The k-mer to id dict needed while counting is dropped
+once the adjacency is built.
+
+NodeStore is a mapping from node id to NodeView, and a NodeView answers the
+same calls as dbg.Node, so DBG runs unchanged on top of it. Edges are never
+removed from the CSR columns: deleting a node clears its alive flag, and the
+views skip dead neighbours.
+"""
+
+import operator
+from array import array
+from collections.abc import Mapping
+
+
+class NodeView:
+    __slots__ = ('_store', '_idx')
+    # number of k-mers the node stands for
+    length = 1
+
+    def __init__(self, store, idx):
+        self._store = store
+        self._idx = idx
+
+    @property
+    def kmer(self):
+        return self._store.kmers[self._idx]
+
+    @property
+    def visited(self):
+        return bool(self._store.visited[self._idx])
+
+    @visited.setter
+    def visited(self, value):
+        self._store.visited[self._idx] = 1 if value else 0
+
+    @property
+    def depth(self):
+        return self._store.depth[self._idx]
+
+    @depth.setter
+    def depth(self, value):
+        self._store.depth[self._idx] = value
+
+    @property
+    def max_depth_child(self):
+        child = self._store.max_depth_child[self._idx]
+        return None if child < 0 else child
+
+    @max_depth_child.setter
+    def max_depth_child(self, value):
+        self._store.max_depth_child[self._idx] = -1 if value is None else value
+
+    def reset(self):
+        self.visited = False
+        self.depth = 0
+        self.max_depth_child = None
+
+    def get_count(self):
+        return self._store.counts[self._idx]
+
+    @property
+    def coverage(self):
+        return self._store.counts[self._idx]
+
+    def get_children(self):
+        return self._store.neighbours(self._store.child_offsets, self._store.child_targets, self._idx)
+
+    def get_parents(self):
+        return self._store.neighbours(self._store.parent_offsets, self._store.parent_targets, self._idx)
+
+    def get_in_degree(self):
+        return self._store.in_degree[self._idx]
+
+    def get_out_degree(self):
+        return self._store.out_degree[self._idx]
+
+    def remove_child(self, kmer):
+        # dead neighbours are skipped when the edges are read
+        pass
+
+    def remove_parent(self, kmer):
+        pass
+
+
+class NodeStore(Mapping):
+    def __init__(self, k, kmers, counts, child_masks, kmer2idx):
+        """Build the store from per-node columns filled in while counting.
+
+        kmers and counts are indexed by node id. child_masks[idx] has bit b set
+        when the k-mer extended by base b is a child of node idx, and kmer2idx
+        resolves those extended k-mers to node ids.
+        """
+        n = len(kmers)
+        self.kmers = kmers
+        self.counts = counts
+        self.depth = array('I', bytes(4 * n))
+        self.max_depth_child = array('i', [-1]) * n
+        self.visited = bytearray(n)
+        self.alive = bytearray(b'\x01') * n
+        self._size = n
+
+        mask = (1 << (2 * k)) - 1
+        self.child_offsets = array('I', [0])
+        self.child_targets = array('i')
+        self.in_degree = in_degree = bytearray(n)
+        self.out_degree = bytearray(n)
+        for idx in range(n):
+            kmer, bits = kmers[idx], child_masks[idx]
+            for base in range(4):
+                if bits >> base & 1:
+                    child = kmer2idx[((kmer << 2) | base) & mask]
+                    self.child_targets.append(child)
+                    in_degree[child] += 1
+            self.child_offsets.append(len(self.child_targets))
+            self.out_degree[idx] = self.child_offsets[-1] - self.child_offsets[-2]
+
+        self.parent_offsets = array('I', [0])
+        for idx in range(n):
+            self.parent_offsets.append(self.parent_offsets[-1] + in_degree[idx])
+        self.parent_targets = array('i', [0]) * len(self.child_targets)
+        fill = array('I', self.parent_offsets[:-1])
+        for idx in range(n):
+            for pos in range(self.child_offsets[idx], self.child_offsets[idx + 1]):
+                child = self.child_targets[pos]
+                self.parent_targets[fill[child]] = idx
+                fill[child] += 1
+
+    @classmethod
+    def from_adjacency(cls, kmers, counts, child_offsets, child_targets,
+                       parent_offsets, parent_targets):
+        """Build the store from CSR adjacency computed elsewhere.
+
+        The columns must be laid out as __init__ lays them out: children of a
+        node in order of their last base, parents in order of id. Nothing is
+        looked up per node, so batch_count can hand over whole arrays.
+        """
+        store = cls.__new__(cls)
+        n = len(kmers)
+        store.kmers = kmers
+        store.counts = counts
+        store.depth = array('I', bytes(4 * n))
+        store.max_depth_child = array('i', [-1]) * n
+        store.visited = bytearray(n)
+        store.alive = bytearray(b'\x01') * n
+        store._size = n
+        store.child_offsets, store.child_targets = child_offsets, child_targets
+        store.parent_offsets, store.parent_targets = parent_offsets, parent_targets
+        store.out_degree = _degrees(child_offsets)
+        store.in_degree = _degrees(parent_offsets)
+        return store
+
+    def neighbours(self, offsets, targets, idx):
+        alive = self.alive
+        return [t for t in targets[offsets[idx]:offsets[idx + 1]] if alive[t]]
+
+    def __getitem__(self, idx):
+        if idx not in self:
+            raise KeyError(idx)
+        return NodeView(self, idx)
+
+    def __contains__(self, idx):
+        try:
+            return idx >= 0 and self.alive[idx] == 1
+        except (IndexError, TypeError):
+            return False
+
+    def __delitem__(self, idx):
+        if idx not in self:
+            raise KeyError(idx)
+        for child in self.neighbours(self.child_offsets, self.child_targets, idx):
+            self.in_degree[child] -= 1
+        for parent in self.neighbours(self.parent_offsets, self.parent_targets, idx):
+            self.out_degree[parent] -= 1
+        self.alive[idx] = 0
+        self._size -= 1
+
+    def __iter__(self):
+        alive = self.alive
+        for idx in range(len(alive)):
+            if alive[idx]:
+                yield idx
+
+    def __len__(self):
+        return self._size
+
+
+def _degrees(offsets):
+    return bytearray(map(operator.sub, offsets[1:], offsets[:-1]))
+
+
+# the reverse complement of every byte of four packed bases
+_RC_BYTE = bytes(sum((3 - (b >> 2 * i & 3)) << 2 * (3 - i) for i in range(4)) for b in range(256))
+
+
+class OrientedNodeView(NodeView):
+    """A NodeView of one strand of a k-mer in a BidirectedStore."""
+    __slots__ = ()
+
+    @property
+    def kmer(self):
+        kmer = self._store.kmers[self._idx >> 1]
+        return self._store.reverse_complement(kmer) if self._idx & 1 else kmer
+
+    @property
+    def twin(self):
+        return self._idx ^ 1
+
+    def get_count(self):
+        return self._store.counts[self._idx >> 1]
+
+    @property
+    def coverage(self):
+        return self._store.counts[self._idx >> 1]
+
+    def get_children(self):
+        return self._store.children(self._idx)
+
+    def get_parents(self):
+        return self._store.parents(self._idx)
+
+    def get_in_degree(self):
+        # the parents of a strand are the children of the other strand
+        return self._store.out_degree[self._idx ^ 1]
+
+
+class BidirectedStore(NodeStore):
+    """A NodeStore that keeps a k-mer and its reverse complement in one node.
+
+    Every column except the per-strand search state (depth, max_depth_child,
+    visited) and the adjacency is indexed by canonical k-mer, so the counts
+    and k-mers of a strand pair are stored once. Node ids are oriented:
+    2 * i is canonical k-mer i and 2 * i + 1 its reverse complement, and
+    id ^ 1 is the twin of id. An edge u -> v implies the edge v ^ 1 -> u ^ 1,
+    so only children are stored and the parents of u are the twins of the
+    children of u ^ 1. Deleting either strand deletes the node.
+    """
+
+    def __init__(self, k, kmers, counts, child_masks, kmer2idx):
+        """Build the store from per-k-mer columns filled in while counting.
+
+        kmers holds canonical k-mers. Bits 0-3 of child_masks[idx] are the
+        bases that extend the canonical strand of idx, bits 4-7 those that
+        extend its reverse complement. k must be odd, so that no k-mer is its
+        own reverse complement.
+        """
+        n = len(kmers)
+        self.kmers = kmers
+        self.counts = counts
+        self.depth = array('I', bytes(8 * n))
+        self.max_depth_child = array('i', [-1]) * (2 * n)
+        self.visited = bytearray(2 * n)
+        self.alive = bytearray(b'\x01') * n
+        self._size = 2 * n
+        self._rc_shift = 2 * (32 - k)
+
+        mask = (1 << (2 * k)) - 1
+        shift = 2 * (k - 1)
+        self.child_offsets = array('I', [0])
+        self.child_targets = array('i')
+        self.out_degree = bytearray(2 * n)
+        for idx in range(n):
+            kmer = kmers[idx]
+            rc = self.reverse_complement(kmer)
+            for strand, (fwd, rev) in enumerate(((kmer, rc), (rc, kmer))):
+                bits = child_masks[idx] >> (4 * strand)
+                for base in range(4):
+                    if bits >> base & 1:
+                        child = ((fwd << 2) | base) & mask
+                        child_rc = ((3 - base) << shift) | (rev >> 2)
+                        if child <= child_rc:
+                            self.child_targets.append(2 * kmer2idx[child])
+                        else:
+                            self.child_targets.append(2 * kmer2idx[child_rc] + 1)
+                self.child_offsets.append(len(self.child_targets))
+                self.out_degree[2 * idx + strand] = self.child_offsets[-1] - self.child_offsets[-2]
+
+    @classmethod
+    def from_adjacency(cls, k, kmers, counts, child_offsets, child_targets):
+        """Build the store from the CSR children of every oriented node id."""
+        store = cls.__new__(cls)
+        n = len(kmers)
+        store.kmers = kmers
+        store.counts = counts
+        store.depth = array('I', bytes(8 * n))
+        store.max_depth_child = array('i', [-1]) * (2 * n)
+        store.visited = bytearray(2 * n)
+        store.alive = bytearray(b'\x01') * n
+        store._size = 2 * n
+        store._rc_shift = 2 * (32 - k)
+        store.child_offsets, store.child_targets = child_offsets, child_targets
+        store.out_degree = _degrees(child_offsets)
+        return store
+
+    def reverse_complement(self, kmer):
+        # reverses 32 bases a byte at a time, then drops the padding
+        return int.from_bytes(kmer.to_bytes(8, 'little').translate(_RC_BYTE), 'big') >> self._rc_shift
+
+    def neighbours(self, offsets, targets, idx):
+        alive = self.alive
+        return [t for t in targets[offsets[idx]:offsets[idx + 1]] if alive[t >> 1]]
+
+    def children(self, idx):
+        return self.neighbours(self.child_offsets, self.child_targets, idx)
+
+    def parents(self, idx):
+        return [t ^ 1 for t in self.children(idx ^ 1)]
+
+    def __getitem__(self, idx):
+        if idx not in self:
+            raise KeyError(idx)
+        return OrientedNodeView(self, idx)
+
+    def __contains__(self, idx):
+        try:
+            return idx >= 0 and self.alive[idx >> 1] == 1
+        except (IndexError, TypeError):
+            return False
+
+    def __delitem__(self, idx):
+        if idx not in self:
+            raise KeyError(idx)
+        node = idx >> 1
+        # every edge of either strand is counted once, in the out-degree of
+        # the twin of its other end
+        for strand in (2 * node, 2 * node + 1):
+            for t in self.children(strand):
+                if t >> 1 != node:
+                    self.out_degree[t ^ 1] -= 1
+        self.alive[node] = 0
+        self._size -= 2
+
+    def __iter__(self):
+        alive = self.alive
+        for idx in range(len(alive)):
+            if alive[idx]:
+                yield 2 * idx
+                yield 2 * idx + 1
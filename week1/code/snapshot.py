@@ -0,0 +1,85 @@
+"""Write the columns of an array-store graph to a binary file and map them back.
+
+A snapshot is a fixed header followed by the raw columns of a NodeStore or
+BidirectedStore, each starting on an 8-byte boundary:
+
+    magic      8 bytes, b'DBGSNAP1'
+    k          uint32
+    flags      uint32, bit 0 set for a bidirected graph, bit 1 for big-endian
+    checksum   32 bytes, identifying the input the graph was built from
+    lengths    6 x uint64, the number of items in every column
+    columns    kmers (Q), counts (I), child_offsets (I), child_targets (i),
+               parent_offsets (I), parent_targets (i)
+
+A bidirected graph has no parent columns, and their lengths are 0. Columns are
+in the byte order of the machine that wrote them. read_snapshot maps the file
+copy-on-write and hands the columns out as memoryviews into the map, so
+nothing is parsed or copied up front: pages are read from disk as the graph
+touches them, and writes stay private to the process.
+"""
+
+import mmap
+import struct
+import sys
+
+MAGIC = b'DBGSNAP1'
+COLUMNS = [('kmers', 'Q'), ('counts', 'I'), ('child_offsets', 'I'), ('child_targets', 'i'),
+           ('parent_offsets', 'I'), ('parent_targets', 'i')]
+_HEADER = struct.Struct('<8sII32s%dQ' % len(COLUMNS))
+_BIDIRECTED, _BIG_ENDIAN = 1, 2
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def write_snapshot(path, k, bidirected, checksum, columns):
+    """Write columns, a dict from the names in COLUMNS to arrays, to path.
+
+    checksum is a bytes value of up to 32 bytes.
+    """
+    assert len(checksum) <= 32
+    views = [memoryview(columns[name]) if name in columns else memoryview(b'').cast(code)
+             for name, code in COLUMNS]
+    for view, (name, code) in zip(views, COLUMNS):
+        assert view.format == code, name
+    flags = (_BIDIRECTED if bidirected else 0) | (_BIG_ENDIAN if sys.byteorder == 'big' else 0)
+    with open(path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, k, flags, checksum, *(len(view) for view in views)))
+        for view in views:
+            f.write(bytes(_align(f.tell()) - f.tell()))
+            f.write(view)
+
+
+def read_snapshot(path, checksum=None):
+    """Map the snapshot at path; return (k, bidirected, columns).
+
+    columns maps every name of COLUMNS to a memoryview of its items; a
+    bidirected snapshot has no parent columns. Raises ValueError when path is
+    not a snapshot, was written on a machine of the other byte order, is
+    truncated, or when checksum is given and differs from the stored one.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(_HEADER.size)
+        if len(header) < _HEADER.size or header[:len(MAGIC)] != MAGIC:
+            raise ValueError('%s is not a graph snapshot' % path)
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    magic, k, flags, stored, *lengths = _HEADER.unpack(header)
+    if bool(flags & _BIG_ENDIAN) != (sys.byteorder == 'big'):
+        raise ValueError('%s was written with the other byte order' % path)
+    if checksum is not None and stored != checksum.ljust(32, b'\0'):
+        raise ValueError('%s does not match the input checksum' % path)
+
+    view = memoryview(buf)
+    columns, offset = {}, _HEADER.size
+    for (name, code), length in zip(COLUMNS, lengths):
+        offset = _align(offset)
+        end = offset + length * struct.calcsize(code)
+        if end > len(buf):
+            raise ValueError('%s is truncated' % path)
+        columns[name] = view[offset:end].cast(code)
+        offset = end
+    bidirected = bool(flags & _BIDIRECTED)
+    if bidirected:
+        del columns['parent_offsets'], columns['parent_targets']
+    return k, bidirected, columns
@@ -1,13 +1,135 @@
 import os
+import mmap
+import hashlib
+import itertools
+
+
+def _fasta_records(f):
+    name, chunks = None, []
+    for line in f:
+        line = line.strip()
+        if not line:
+            continue
+        if line[0] == '>':
+            if name is not None:
+                yield name, ''.join(chunks)
+            name, chunks = line[1:], []
+        else:
+            chunks.append(line)
+    if name is not None:
+        yield name, ''.join(chunks)
+
+
+def _fastq_records(f):
+    lines = (line.strip() for line in f)
+    for header in lines:
+        if not header:
+            continue
+        chunks = []
+        for line in lines:
+            if line.startswith('+'):
+                break
+            chunks.append(line)
+        seq = ''.join(chunks)
+        # quality lines may start with '@' too, so consume them by length
+        qual = 0
+        for line in lines:
+            qual += len(line)
+            if qual >= len(seq):
+                break
+        yield header[1:], seq
+
+
+def stream_records(path):
+    """Yield (name, sequence) for every record of a FASTA or FASTQ file.
+
+    The file is read one line at a time, so memory use does not grow with its
+    size. FASTA records may be wrapped over several lines and blank lines are
+    skipped. The format is picked from the first character of the file.
+    """
+    with open(path, 'r') as f:
+        first = f.read(1)
+        f.seek(0)
+        if first == '@':
+            yield from _fastq_records(f)
+        else:
+            yield from _fasta_records(f)
+
+
+def stream_reads(path):
+    for _, seq in stream_records(path):
+        yield seq
+
+
+def _mapped_lines(buf):
+    # (start, end) of every non-blank line, without its line terminator
+    pos, size = 0, len(buf)
+    while pos < size:
+        end = buf.find(b'\n', pos)
+        if end < 0:
+            end = size
+        stop = end
+        while stop > pos and buf[stop - 1] in b'\r \t':
+            stop -= 1
+        if stop > pos:
+            yield pos, stop
+        pos = end + 1
+
+
+def mmap_reads(path):
+    """Yield the sequences of a FASTA/FASTQ file as windows over a memory map.
+
+    Record boundaries are found by scanning the mapped bytes, and every
+    single-line sequence is handed out as a memoryview into the map, without
+    decoding or copying it. Only sequences wrapped over several lines are
+    joined into a new bytes object. kmer_codes and DBG accept these windows
+    like str reads.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(buf)
+    lines = _mapped_lines(buf)
+    if buf[:1] == b'@':
+        for _ in lines:
+            parts = []
+            for start, end in lines:
+                if buf[start] == ord('+'):
+                    break
+                parts.append(view[start:end])
+            seq = parts[0] if len(parts) == 1 else b''.join(parts)
+            qual = 0
+            for start, end in lines:
+                qual += end - start
+                if qual >= len(seq):
+                    break
+            yield seq
+        return
+    parts = None
+    for start, end in lines:
+        if buf[start] == ord('>'):
+            if parts:
+                yield parts[0] if len(parts) == 1 else b''.join(parts)
+            parts = []
+        elif parts is not None:
+            parts.append(view[start:end])
+    if parts:
+        yield parts[0] if len(parts) == 1 else b''.join(parts)
+
+
+def stream_chunks(path, chunk_size=10000):
+    """Yield the sequences of a FASTA/FASTQ file in lists of up to chunk_size."""
+    reads = stream_reads(path)
+    while True:
+        chunk = list(itertools.islice(reads, chunk_size))
+        if not chunk:
+            return
+        yield chunk
 
 
 def read_fasta(path, name):
-    data = []
-    with open(os.path.join(path, name), 'r') as f:
-        for line in f.readlines():
-            line = line.strip()
-            if line[0] != '>':
-                data.append(line)
+    data = list(stream_reads(os.path.join(path, name)))
     print(name, len(data), len(data[0]))
     # print('Sample:', data[0])
     return data
@@ -18,3 +140,36 @@ def read_data(path):
     short2 = read_fasta(path, "short_2.fasta")
     long1 = read_fasta(path, "long.fasta")
     return short1, short2, long1
+
+
+def stream_data(path, reader=stream_reads):
+    # the same files as read_data, as lazy read iterators DBG can consume;
+    # a dataset without long reads (data4) gets an empty long1
+    short1 = reader(os.path.join(path, "short_1.fasta"))
+    short2 = reader(os.path.join(path, "short_2.fasta"))
+    long_path = os.path.join(path, "long.fasta")
+    long1 = reader(long_path) if os.path.exists(long_path) else iter(())
+    return short1, short2, long1
+
+
+def build_settings(**options):
+    """Return the options a graph was built with as a string for data_checksum."""
+    return ' '.join('%s=%s' % (name, options[name]) for name in sorted(options))
+
+
+def data_checksum(path, settings='', chunk_size=1 << 20):
+    """Return a SHA-256 digest of the read files of a dataset, for DBG snapshots.
+
+    settings is hashed too, so graphs built from the same reads in different
+    ways get different checksums.
+    """
+    digest = hashlib.sha256(settings.encode())
+    for name in ("short_1.fasta", "short_2.fasta", "long.fasta"):
+        file_path = os.path.join(path, name)
+        if not os.path.exists(file_path):
+            continue
+        digest.update(b'%s %d\n' % (name.encode(), os.path.getsize(file_path)))
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+    return digest.digest()
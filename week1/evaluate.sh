@@ -68,19 +68,3 @@ for DATASET in data1 data2 data3 data4; do
 
     echo
 done
-codon_start_time=$(date +%s)
-codon_output=$(~/.codon/bin/codon run -release main_co.codon ${DATASET} 2>&1)
-codon_exit_code=$?
-codon_end_time=$(date +%s)
-codon_runtime=$((codon_end_time - codon_start_time))
-codon_runtime_formatted=$(format_runtime $codon_runtime)
-
-# Extract N50 only if the command was successful
-if [ $codon_exit_code -eq 0 ]; then
-    codon_n50=$(echo "${codon_output}" | grep "N50:" | awk '{print $2}')
-    echo -e "${codon_runtime_formatted}\t${codon_n50}"
-else
-    echo -e "${codon_runtime_formatted}\tERROR"
-    echo "Codon Error:"
-    echo "${codon_output}"
-fi
\ No newline at end of file
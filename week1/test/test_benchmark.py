@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Test the regression check of the benchmark harness.
+"""
+
+import sys
+import os
+# Add the code directory to the Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'code'))
+
+import random
+
+from benchmark import PHASES, compare, count_edges
+from dbg import DBG, reverse_complement
+
+
+def make_result(seconds, rss):
+    median = dict.fromkeys(PHASES, seconds)
+    median['total'] = seconds * len(PHASES)
+    return {'median': median, 'peak_rss_mb': rss}
+
+
+def test_compare():
+    baseline = {'data1': make_result(1.0, 100)}
+    assert compare({'data1': make_result(1.1, 110)}, baseline, tolerance=0.2) == []
+    regressions = compare({'data1': make_result(1.5, 130)}, baseline, tolerance=0.2)
+    assert len(regressions) == len(PHASES) + 2
+    assert any('peak RSS' in message for message in regressions)
+    # datasets missing from the baseline are not compared
+    assert compare({'data2': make_result(9.0, 900)}, baseline, tolerance=0.2) == []
+
+
+def test_compare_ignores_tiny_phases():
+    baseline = {'data1': make_result(0.001, 100)}
+    assert compare({'data1': make_result(0.01, 100)}, baseline, tolerance=0.2) == []
+
+
+def test_count_edges():
+    random.seed(3)
+    genome = ''.join(random.choice('ACGT') for _ in range(500))
+    # a palindromic (k+1)-mer is an edge into the k-mer's own reverse complement
+    reads = [genome[i:i + 60] for i in range(0, 440, 7)] + ['ACGTACGT' + 'TTAAGGCCTTAA' + 'ACGTACGT']
+    k = 11
+    # a bidirected edge is a canonical (k+1)-mer, counted once for both strands
+    arcs = {min(read[i:i + k + 1], reverse_complement(read[i:i + k + 1]))
+            for read in reads for i in range(len(read) - k)}
+    bidirected = DBG(k=k, data_list=[reads], store='array', bidirected=True)
+    assert count_edges(bidirected) == len(arcs)
+    plain = DBG(k=k, data_list=[reads], store='array')
+    assert count_edges(plain) == sum(plain.nodes[idx].get_out_degree() for idx in plain.nodes)
+
+
+if __name__ == "__main__":
+    test_compare()
+    test_compare_ignores_tiny_phases()
+    test_count_edges()
+    print("All benchmark tests passed!")
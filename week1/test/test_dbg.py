@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+Test the de Bruijn graph assembler on small synthetic reads.
+"""
+
+import sys
+import os
+import random
+import tempfile
+# Add the code directory to the Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'code'))
+
+from kmer_filter import KmerFilter
+from utils import build_settings, data_checksum, stream_reads
+from dbg import (DBG, reverse_complement, encode_kmer, decode_kmer,
+                 reverse_complement_code, canonical_kmer, kmer_codes)
+
+READ = 'CCGTAATGCCTTTCCCTAACAGAGTTTTTCGAACTCGTGTTGTCGAGC'
+
+
+def test_kmer_encoding():
+    k = 5
+    fwd, rc = kmer_codes(READ, k)
+    assert len(fwd) == len(READ) - k + 1
+    for i in range(len(fwd)):
+        kmer = READ[i: i + k]
+        assert fwd[i] == encode_kmer(kmer)
+        assert decode_kmer(fwd[i], k) == kmer
+        assert decode_kmer(rc[i], k) == reverse_complement(kmer)
+        assert reverse_complement_code(fwd[i], k) == rc[i]
+        assert canonical_kmer(fwd[i], k) == min(fwd[i], rc[i])
+    # bytes input gives the same codes as str input
+    assert kmer_codes(READ.encode(), k) == (fwd, rc)
+
+
+def test_longest_contig():
+    dbg = DBG(k=7, data_list=[[READ]])
+    contig = dbg.get_longest_contig()
+    assert contig in READ or reverse_complement(contig) in READ
+    assert len(contig) == len(READ) - 1
+
+
+def test_long_chain_without_recursion():
+    random.seed(7)
+    read = ''.join(random.choice('ACGT') for _ in range(20000))
+    dbg = DBG(k=21, data_list=[[read]])
+    assert len(dbg.get_longest_contig()) == len(read) - 1
+
+
+def test_cycle_gives_simple_path():
+    # the repeat closes a cycle through the same k-mers
+    dbg = DBG(k=7, data_list=[[READ[:20] + READ[:20] + READ[:20]]])
+    path = dbg._get_longest_path()
+    assert len(path) == len(set(path))
+
+
+def random_reads(genome, n, length, error_rate=0.0):
+    reads = []
+    for _ in range(n):
+        start = random.randrange(len(genome) - length + 1)
+        read = list(genome[start: start + length])
+        for i in range(length):
+            if random.random() < error_rate:
+                read[i] = random.choice('ACGT')
+        reads.append(''.join(read))
+    return reads
+
+
+def test_incremental_matches_full():
+    random.seed(11)
+    genome = ''.join(random.choice('ACGT') for _ in range(3000))
+    data_list = [random_reads(genome, 200, 100), random_reads(genome, 20, 400, 0.05)]
+    full = DBG(k=15, data_list=data_list)
+    incremental = DBG(k=15, data_list=data_list, incremental=True)
+    for _ in range(20):
+        assert full.get_longest_contig() == incremental.get_longest_contig()
+    assert set(full.nodes) == set(incremental.nodes)
+
+
+def test_compaction_keeps_contigs():
+    random.seed(5)
+    genome = ''.join(random.choice('ACGT') for _ in range(3000))
+    data_list = [random_reads(genome, 200, 100), random_reads(genome, 20, 400, 0.05)]
+    plain = DBG(k=15, data_list=data_list)
+    compacted = DBG(k=15, data_list=data_list, incremental=True)
+    n_kmers = len(compacted.nodes)
+    assert compacted.compact() < n_kmers / 10
+    assert sum(node.length for node in compacted.nodes.values()) == n_kmers
+    for _ in range(20):
+        assert plain.get_longest_contig() == compacted.get_longest_contig()
+
+
+def assert_same_graph(dbg1, dbg2):
+    assert dbg1.kmer2idx == dbg2.kmer2idx
+    for idx, node in dbg1.nodes.items():
+        other = dbg2.nodes[idx]
+        assert node.kmer == other.kmer
+        assert node.get_count() == other.get_count()
+        assert set(node.get_children()) == set(other.get_children())
+        assert set(node.get_parents()) == set(other.get_parents())
+
+
+def test_parallel_build_matches_serial():
+    random.seed(13)
+    genome = ''.join(random.choice('ACGT') for _ in range(2000))
+    data_list = [random_reads(genome, 150, 100, 0.01), random_reads(genome, 10, 300, 0.05)]
+    serial = DBG(k=15, data_list=data_list)
+    parallel = DBG(k=15, data_list=data_list, workers=3, shard_size=25)
+    assert_same_graph(serial, parallel)
+
+
+def test_array_store_matches_dict():
+    random.seed(17)
+    genome = ''.join(random.choice('ACGT') for _ in range(2000))
+    data_list = [random_reads(genome, 150, 100, 0.01), random_reads(genome, 10, 300, 0.05)]
+    plain = DBG(k=15, data_list=data_list)
+    for arrays in (DBG(k=15, data_list=data_list, store='array', incremental=True),
+                   DBG(k=15, data_list=data_list, store='array', workers=2)):
+        assert len(arrays.nodes) == len(plain.nodes)
+        for idx, node in plain.nodes.items():
+            assert arrays.nodes[idx].kmer == node.kmer
+            assert arrays.nodes[idx].get_count() == node.get_count()
+            assert sorted(arrays.nodes[idx].get_children()) == sorted(node.get_children())
+            assert sorted(arrays.nodes[idx].get_parents()) == sorted(node.get_parents())
+    plain = DBG(k=15, data_list=data_list)
+    for _ in range(10):
+        assert plain.get_longest_contig() == arrays.get_longest_contig()
+    assert set(plain.nodes) == set(arrays.nodes)
+
+
+def test_bidirected_graph():
+    random.seed(23)
+    genome = ''.join(random.choice('ACGT') for _ in range(3000))
+    data_list = [random_reads(genome, 200, 100, 0.01), random_reads(genome, 20, 400, 0.05)]
+    plain = DBG(k=15, data_list=data_list, store='array')
+    dbg = DBG(k=15, data_list=data_list, store='array', bidirected=True)
+    # every strand pair is stored once, as its canonical k-mer
+    canonical = {canonical_kmer(plain.nodes[idx].kmer, 15) for idx in plain.nodes}
+    assert dbg.kmer_count == len(canonical) == len(dbg.nodes) // 2
+    assert set(dbg.nodes.kmers) == canonical
+    for idx in dbg.nodes:
+        node = dbg.nodes[idx]
+        assert reverse_complement_code(node.kmer, 15) == dbg.nodes[node.twin].kmer
+        assert sorted(node.get_parents()) == sorted(t ^ 1 for t in dbg.nodes[idx ^ 1].get_children())
+        assert node.get_in_degree() == len(node.get_parents())
+    assert_same_nodes(dbg, DBG(k=15, data_list=data_list, store='array', bidirected=True,
+                               workers=2, shard_size=30))
+
+    compacted = DBG(k=15, data_list=data_list, store='array', bidirected=True, incremental=True)
+    compacted.compact()
+    contigs = []
+    for _ in range(20):
+        contig = dbg.get_longest_contig()
+        assert contig == compacted.get_longest_contig()
+        contigs.append(contig)
+    # the other strand of a contig goes with it
+    assert not any(reverse_complement(contig) in contigs for contig in contigs)
+
+
+def assert_same_nodes(dbg1, dbg2):
+    assert list(dbg1.nodes) == list(dbg2.nodes)
+    for idx in dbg1.nodes:
+        assert dbg1.nodes[idx].kmer == dbg2.nodes[idx].kmer
+        assert dbg1.nodes[idx].get_count() == dbg2.nodes[idx].get_count()
+        assert dbg1.nodes[idx].get_children() == dbg2.nodes[idx].get_children()
+
+
+def assert_same_columns(dbg1, dbg2):
+    names = ['kmers', 'counts', 'child_offsets', 'child_targets', 'out_degree']
+    if not dbg1.bidirected:
+        names += ['parent_offsets', 'parent_targets', 'in_degree']
+    for name in names:
+        assert getattr(dbg1.nodes, name) == getattr(dbg2.nodes, name), name
+    assert dbg1.kmer_count == dbg2.kmer_count
+
+
+def test_batch_build_matches_serial():
+    random.seed(29)
+    genome = ''.join(random.choice('ACGT') for _ in range(2000))
+    # short reads have no arcs, and byte strings count like str
+    reads = random_reads(genome, 10, 300, 0.05) + ['ACGT', genome[:16], genome[5:20].lower()]
+    data_list = [random_reads(genome, 150, 100, 0.01), [read.encode() for read in reads]]
+    for bidirected in (False, True):
+        serial = DBG(k=15, data_list=data_list, store='array', bidirected=bidirected)
+        for batch_size in (10**6, 1000, 1):
+            batch = DBG(k=15, data_list=data_list, store='array', bidirected=bidirected,
+                        batch_size=batch_size)
+            assert_same_columns(serial, batch)
+        for _ in range(5):
+            assert serial.get_longest_contig() == batch.get_longest_contig()
+    try:
+        DBG(k=15, data_list=[[genome[:50] + 'N' + genome[50:100]]], store='array', batch_size=100)
+    except KeyError:
+        pass
+    else:
+        assert False, 'an unknown base should be rejected'
+
+
+def test_partitioned_build():
+    random.seed(41)
+    genome = ''.join(random.choice('ACGT') for _ in range(3000))
+    data_list = [random_reads(genome, 200, 100, 0.01), random_reads(genome, 10, 400, 0.02)]
+    with tempfile.TemporaryDirectory() as tmp:
+        for bidirected in (False, True):
+            batch = DBG(k=15, data_list=data_list, store='array', bidirected=bidirected,
+                        batch_size=5000)
+            # a memory limit this small makes every bucket split again
+            for partitions, memory in ((4, None), (3, 50000), (1, 5000)):
+                partitioned = DBG(k=15, data_list=data_list, store='array',
+                                  bidirected=bidirected, batch_size=5000,
+                                  partitions=partitions, memory=memory, tmpdir=tmp)
+                assert_same_columns(batch, partitioned)
+            assert partitioned.get_longest_contig() == batch.get_longest_contig()
+        # the bucket files are removed once the graph is built
+        assert os.listdir(tmp) == []
+
+
+def test_kmer_filter():
+    random.seed(31)
+    genome = ''.join(random.choice('ACGT') for _ in range(3000))
+    data_list = [random_reads(genome, 200, 80, 0.02), random_reads(genome, 20, 300, 0.02)]
+    k, min_count = 15, 2
+    # the k-mers a filter without collisions admits: those on min_count arcs
+    seen = {}
+    for data in data_list:
+        for read in data:
+            fwd, rc = kmer_codes(read, k)
+            if len(fwd) > 2:
+                for kmer in fwd[:-1] + rc[1:]:
+                    seen[kmer] = seen.get(kmer, 0) + 1
+    solid = {kmer for kmer, count in seen.items() if count >= min_count}
+    full = DBG(k=k, data_list=data_list, store='array')
+    counts = {full.nodes[idx].kmer: full.nodes[idx].get_count() for idx in full.nodes}
+    edges = {(full.nodes[idx].kmer, full.nodes[child].kmer) for idx in full.nodes
+             for child in full.nodes[idx].get_children()}
+    builds = [DBG(k=k, data_list=data_list, store=store,
+                  kmer_filter=KmerFilter(1 << 22, min_count)) for store in ('dict', 'array')]
+    builds.append(DBG(k=k, data_list=data_list, store='array', batch_size=10**6,
+                      kmer_filter=KmerFilter(1 << 22, min_count)))
+    for dbg in builds:
+        assert {dbg.nodes[idx].kmer for idx in dbg.nodes} == solid
+        for idx in dbg.nodes:
+            node = dbg.nodes[idx]
+            # the occurrences counted in the filter are only estimated
+            assert abs(node.get_count() - counts[node.kmer]) <= 2 * (min_count - 1)
+            for child in node.get_children():
+                assert (node.kmer, dbg.nodes[child].kmer) in edges
+        assert len(dbg.nodes) < len(full.nodes)
+    serial, batch = builds[1], builds[2]
+    serial_edges, batch_edges = [{(dbg.nodes[idx].kmer, dbg.nodes[child].kmer) for idx in dbg.nodes
+                                  for child in dbg.nodes[idx].get_children()}
+                                 for dbg in (serial, batch)]
+    # a block keeps the arcs seen before both ends were admitted, too
+    assert serial_edges <= batch_edges
+    assert serial.get_longest_contig() in genome
+    # canonical k-mers are filtered the same way
+    bidirected = DBG(k=k, data_list=data_list, store='array', bidirected=True,
+                     kmer_filter=KmerFilter(1 << 22, min_count))
+    assert 0 < bidirected.kmer_count < len(solid)
+    # a filter far too small admits almost everything
+    tiny = KmerFilter(64, min_count)
+    DBG(k=k, data_list=data_list, store='array', kmer_filter=tiny)
+    assert tiny.false_positive_rate() > 0.9
+    assert KmerFilter(1 << 22, min_count).false_positive_rate() == 0
+
+
+def test_snapshot():
+    random.seed(37)
+    genome = ''.join(random.choice('ACGT') for _ in range(2000))
+    data_list = [random_reads(genome, 150, 100, 0.01)]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'graph.snap')
+        for bidirected in (False, True):
+            dbg = DBG(k=15, data_list=data_list, store='array', bidirected=bidirected)
+            dbg.save(path, b'reads')
+            loaded = DBG.load(path, b'reads', incremental=True)
+            assert loaded.k == 15 and loaded.bidirected == bidirected
+            assert loaded.kmer_count == dbg.kmer_count
+            assert_same_columns(dbg, loaded)
+            assert loaded.compact() == dbg.compact()
+            for _ in range(5):
+                assert loaded.get_longest_contig() == dbg.get_longest_contig()
+        # a snapshot of other reads, or another file, is rejected
+        fasta = os.path.join(tmp, 'reads.fasta')
+        with open(fasta, 'w') as f:
+            f.write('>read\n%s\n' % genome)
+        for args in ((path, b'other reads'), (fasta,)):
+            try:
+                DBG.load(*args)
+            except ValueError:
+                pass
+            else:
+                assert False, 'a stale snapshot should be rejected'
+
+        # with a filter, serial and batch builds keep different counts, so a
+        # snapshot of one build mode is stale for the other
+        dataset = os.path.join(tmp, 'dataset')
+        os.mkdir(dataset)
+        with open(os.path.join(dataset, 'short_1.fasta'), 'w') as f:
+            for i, read in enumerate(data_list[0]):
+                f.write('>read_%d\n%s\n' % (i, read))
+        checksums, graphs = [], []
+        for batch_size in (0, 10**6):
+            settings = build_settings(k=15, store='array', bidirected=False,
+                                      batch_size=batch_size, min_count=2, filter_memory=1)
+            checksums.append(data_checksum(dataset, settings))
+            graphs.append(DBG(k=15, data_list=[stream_reads(os.path.join(dataset, 'short_1.fasta'))],
+                              store='array', batch_size=batch_size,
+                              kmer_filter=KmerFilter(1 << 20, 2)))
+        assert graphs[0].nodes.counts != graphs[1].nodes.counts
+        assert checksums[0] != checksums[1]
+        for saved, loaded in ((0, 1), (1, 0)):
+            graphs[saved].save(path, checksums[saved])
+            assert DBG.load(path, checksums[saved]).nodes.counts == graphs[saved].nodes.counts
+            try:
+                DBG.load(path, checksums[loaded])
+            except ValueError:
+                pass
+            else:
+                assert False, 'a snapshot of the other build mode should be rejected'
+        # only fresh array-store graphs can be saved
+        graphs[0].compact()
+        for dbg in (graphs[0], DBG(k=15, data_list=data_list)):
+            try:
+                dbg.save(path)
+            except ValueError:
+                pass
+            else:
+                assert False, 'the graph should not be saved'
+
+
+def test_clean_removes_errors():
+    random.seed(19)
+    genome = ''.join(random.choice('ACGT') for _ in range(2000))
+    reads = random_reads(genome, 400, 100)
+    # one read with a single substitution makes a bubble, one with an error
+    # near its end makes a tip
+    bubble = list(reads[0])
+    bubble[50] = 'A' if bubble[50] != 'A' else 'C'
+    tip = list(reads[1])
+    tip[-5] = 'A' if tip[-5] != 'A' else 'C'
+    data_list = [reads, [''.join(bubble), ''.join(tip)]]
+    dbg = DBG(k=15, data_list=data_list)
+    assert dbg.solid_cutoff() > 1
+    n_kmers = len(dbg.nodes)
+    dbg.remove_low_coverage(1)
+    assert len(dbg.nodes) == n_kmers
+    dirty = DBG(k=15, data_list=data_list)
+    dirty.compact()
+    assert dirty.pop_bubbles(30) == 2
+    assert dirty.clip_tips(15) == 2
+    dbg = DBG(k=15, data_list=data_list, incremental=True)
+    removed = dbg.clean(cutoff=1)
+    assert removed['bubbles'] == 2 and removed['tips'] == 2
+    contig = dbg.get_longest_contig()
+    assert contig in genome or reverse_complement(contig) in genome
+    # only the other strand is left, as a single unitig
+    assert len(dbg.nodes) == 1
+    # in a bidirected graph the other strand goes with the contig
+    dbg = DBG(k=15, data_list=data_list, store='array', bidirected=True)
+    removed = dbg.clean(cutoff=1)
+    assert removed['bubbles'] == 2 and removed['tips'] == 2
+    contig = dbg.get_longest_contig()
+    assert contig in genome or reverse_complement(contig) in genome
+    assert len(dbg.nodes) == 0
+
+
+if __name__ == "__main__":
+    test_kmer_encoding()
+    test_longest_contig()
+    test_long_chain_without_recursion()
+    test_cycle_gives_simple_path()
+    test_incremental_matches_full()
+    test_compaction_keeps_contigs()
+    test_parallel_build_matches_serial()
+    test_array_store_matches_dict()
+    test_bidirected_graph()
+    test_batch_build_matches_serial()
+    test_partitioned_build()
+    test_kmer_filter()
+    test_snapshot()
+    test_clean_removes_errors()
+    print("All DBG tests passed!")
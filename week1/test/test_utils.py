@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Test the FASTA/FASTQ readers.
+"""
+
+import sys
+import os
+import tempfile
+# Add the code directory to the Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'code'))
+
+from utils import stream_records, stream_reads, stream_chunks, read_fasta, mmap_reads
+from dbg import DBG
+
+
+def write_temp(text):
+    f = tempfile.NamedTemporaryFile('w', suffix='.fasta', delete=False)
+    f.write(text)
+    f.close()
+    return f.name
+
+
+def test_wrapped_fasta():
+    path = write_temp('>r1\nACGT\nTTGA\n\n>r2 desc\nGGCC\n\n')
+    assert list(stream_records(path)) == [('r1', 'ACGTTTGA'), ('r2 desc', 'GGCC')]
+    assert read_fasta(os.path.dirname(path), os.path.basename(path)) == ['ACGTTTGA', 'GGCC']
+    os.remove(path)
+
+
+def test_fastq():
+    # the second quality line starts with '@', like a header would
+    path = write_temp('@r1\nACGTAC\n+\nIIIIII\n@r2\nGGCCAA\nTT\n+r2\n@IIII\nII\n')
+    assert list(stream_reads(path)) == ['ACGTAC', 'GGCCAATT']
+    os.remove(path)
+
+
+def test_chunks():
+    path = write_temp(''.join('>r%d\nACGTACGT\n' % i for i in range(7)))
+    assert [len(chunk) for chunk in stream_chunks(path, chunk_size=3)] == [3, 3, 1]
+    os.remove(path)
+
+
+def test_dbg_consumes_stream():
+    reads = ['CCGTAATGCCTTTCCCTAACAGAG', 'CCTAACAGAGTTTTTCGAACTCGTGTTGTCGAGC']
+    path = write_temp(''.join('>r%d\n%s\n' % (i, read) for i, read in enumerate(reads)))
+    streamed = DBG(k=7, data_list=[stream_reads(path)])
+    listed = DBG(k=7, data_list=[reads])
+    assert streamed.kmer2idx == listed.kmer2idx
+    assert streamed.get_longest_contig() == listed.get_longest_contig()
+    os.remove(path)
+
+
+def test_mmap_reads():
+    for text in ('>r1\nACGT\r\nTTGA\n\n>r2\nGGCC', '@r1\nACGTAC\n+\n@IIIII\n@r2\nGG\nCC\n+\nIIII\n'):
+        path = write_temp(text)
+        assert [bytes(read).decode() for read in mmap_reads(path)] == list(stream_reads(path))
+        os.remove(path)
+    path = write_temp('')
+    assert list(mmap_reads(path)) == []
+    os.remove(path)
+
+
+def test_dbg_consumes_mmap():
+    reads = ['CCGTAATGCCTTTCCCTAACAGAG', 'CCTAACAGAGTTTTTCGAACTCGTGTTGTCGAGC']
+    path = write_temp(''.join('>r%d\n%s\n' % (i, read) for i, read in enumerate(reads)))
+    mapped = DBG(k=7, data_list=[mmap_reads(path)])
+    parallel = DBG(k=7, data_list=[mmap_reads(path)], workers=2)
+    listed = DBG(k=7, data_list=[reads])
+    assert mapped.kmer2idx == listed.kmer2idx == parallel.kmer2idx
+    assert mapped.get_longest_contig() == listed.get_longest_contig()
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    test_wrapped_fasta()
+    test_fastq()
+    test_chunks()
+    test_dbg_consumes_stream()
+    test_mmap_reads()
+    test_dbg_consumes_mmap()
+    print("All utils tests passed!")
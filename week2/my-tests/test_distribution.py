@@ -14,6 +14,7 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
 
 import numpy as np
 from matrix import FrequencyPositionMatrix
+from thresholds import ScoreDistribution, DistributionCache
 
 def test_pssm_distribution():
     """Test PSSM distribution calculation."""
@@ -58,5 +59,146 @@ def test_pssm_distribution():
     
     print("\nPSSM distribution test completed!")
 
+def reference_densities(distribution, pssm, background):
+    """Run the dynamic programming one bin at a time, as it used to be done."""
+    n = distribution.n_points
+    mo_density = [0.0] * n
+    bg_density = [0.0] * n
+    mo_density[-distribution._index_diff(distribution.min_score)] = 1.0
+    bg_density[-distribution._index_diff(distribution.min_score)] = 1.0
+    for position in range(pssm.length):
+        mo_new = [0.0] * n
+        bg_new = [0.0] * n
+        for letter in pssm.alphabet:
+            bg = background[letter]
+            mo = pow(2, pssm[letter, position]) * bg
+            d = distribution._index_diff(pssm[letter, position])
+            for i in range(n):
+                j = max(0, min(n - 1, i + d))
+                mo_new[j] += mo_density[i] * mo
+                bg_new[j] += bg_density[i] * bg
+        mo_density, bg_density = mo_new, bg_new
+    return mo_density, bg_density
+
+
+def test_density_arrays():
+    """Test the array-based densities against the bin-by-bin computation."""
+    print("Testing ScoreDistribution densities...")
+    counts = {
+        'A': [5, 2, 1, 3, 0, 9],
+        'C': [2, 5, 6, 1, 1, 0],
+        'G': [1, 2, 2, 5, 8, 0],
+        'T': [2, 1, 1, 1, 1, 1]
+    }
+    pssm = FrequencyPositionMatrix("ACGT", counts).normalize(pseudocounts=0.25).log_odds()
+    background = {'A': 0.3, 'C': 0.2, 'G': 0.2, 'T': 0.3}
+    distribution = ScoreDistribution(precision=50, pssm=pssm, background=background)
+    mo_density, bg_density = reference_densities(distribution, pssm, background)
+    assert np.allclose(distribution.mo_density, mo_density, rtol=1e-12, atol=1e-15)
+    assert np.allclose(distribution.bg_density, bg_density, rtol=1e-12, atol=1e-15)
+    assert abs(distribution.bg_density.sum() - 1.0) < 1e-9
+    print("✓ densities match the bin-by-bin computation")
+
+
+def test_distribution_cache():
+    """Test that cached distributions are reused in memory and from disk."""
+    import tempfile
+    print("Testing DistributionCache...")
+    counts = {
+        'A': [5, 2, 1, 3],
+        'C': [2, 5, 6, 1],
+        'G': [1, 2, 2, 5],
+        'T': [2, 1, 1, 1]
+    }
+    pssm = FrequencyPositionMatrix("ACGT", counts).normalize().log_odds()
+    other = FrequencyPositionMatrix("ACGT", counts).normalize(pseudocounts=1).log_odds()
+    background = {'A': 0.3, 'C': 0.2, 'G': 0.2, 'T': 0.3}
+    with tempfile.TemporaryDirectory() as directory:
+        cache = DistributionCache(directory, maxsize=1)
+        distribution = pssm.distribution(background, precision=100, cache=cache)
+        assert (cache.hits, cache.misses) == (0, 1)
+        assert pssm.distribution(background, precision=100, cache=cache) is distribution
+        assert (cache.hits, cache.misses) == (1, 1)
+        # another background, precision or matrix is another entry
+        pssm.distribution(precision=100, cache=cache)
+        pssm.distribution(background, precision=50, cache=cache)
+        other.distribution(background, precision=100, cache=cache)
+        assert (cache.hits, cache.misses) == (1, 4)
+        assert len(os.listdir(directory)) == 4
+        # a new cache on the same directory, as in the next run, loads it
+        cache = DistributionCache(directory)
+        cached = pssm.distribution(background, precision=100, cache=cache)
+        assert (cache.hits, cache.misses) == (1, 0)
+        assert np.array_equal(cached.bg_density, distribution.bg_density)
+        assert cached.threshold_fpr(0.01) == distribution.threshold_fpr(0.01)
+        assert cached.threshold_patser() == distribution.threshold_patser()
+    print("✓ distributions were reused from memory and from disk")
+
+
+def test_threshold_queries():
+    """Test the binary-search thresholds against walking the densities."""
+    print("Testing threshold and p-value queries...")
+    counts = {
+        'A': [5, 2, 1, 3, 0, 9, 4],
+        'C': [2, 5, 6, 1, 1, 0, 4],
+        'G': [1, 2, 2, 5, 8, 0, 1],
+        'T': [2, 1, 1, 1, 1, 1, 1]
+    }
+    pssm = FrequencyPositionMatrix("ACGT", counts).normalize(pseudocounts=0.25).log_odds()
+    distribution = pssm.distribution(precision=100)
+    bg_density = list(distribution.bg_density)
+    mo_density = list(distribution.mo_density)
+
+    def walk_fpr(fpr):
+        i, prob = distribution.n_points, 0.0
+        while prob < fpr:
+            i -= 1
+            prob += bg_density[i]
+        return distribution.min_score + i * distribution.step
+
+    def walk_fnr(fnr):
+        i, prob = -1, 0.0
+        while prob < fnr:
+            i += 1
+            prob += mo_density[i]
+        return distribution.min_score + i * distribution.step
+
+    def walk_balanced(rate_proportion):
+        i, fpr, fnr = distribution.n_points, 0.0, 1.0
+        while fpr * rate_proportion < fnr:
+            i -= 1
+            fpr += bg_density[i]
+            fnr -= mo_density[i]
+        return distribution.min_score + i * distribution.step, fpr
+
+    rates = [0.0, 1e-8, 1e-5, 1e-3, 0.05, 0.3, 0.9]
+    for rate in rates:
+        assert distribution.threshold_fpr(rate) == walk_fpr(rate)
+        assert distribution.threshold_fnr(rate) == walk_fnr(rate)
+    for rate_proportion in (0.01, 1.0, 100.0):
+        assert distribution.threshold_balanced(rate_proportion, True) == walk_balanced(rate_proportion)
+    # many rates at once give the same thresholds
+    thresholds = distribution.threshold_fpr(np.array(rates))
+    assert list(thresholds) == [walk_fpr(rate) for rate in rates]
+    # p-values invert threshold_fpr
+    pvalues = distribution.pvalue(thresholds)
+    assert np.all(pvalues >= rates)
+    assert distribution.pvalue(thresholds[3]) == pvalues[3]
+    assert abs(distribution.pvalue(distribution.min_score - 1) - 1.0) < 1e-9
+    assert distribution.pvalue(pssm.max + 1) == 0.0
+    # windows with an ambiguous base score NaN, and so do their p-values
+    sequence = "ACGTTGCANNACGGTACGATCGRTTACG"
+    scores = pssm.calculate(sequence)
+    pvalues = distribution.pvalue(scores)
+    assert np.array_equal(np.isnan(pvalues), np.isnan(scores)) and np.isnan(scores).any()
+    assert list(pvalues[~np.isnan(scores)]) == [distribution.pvalue(score)
+                                                for score in scores[~np.isnan(scores)]]
+    assert np.isnan(distribution.pvalue(float("nan")))
+    print("✓ thresholds match walking the densities")
+
+
 if __name__ == "__main__":
-    test_pssm_distribution()
\ No newline at end of file
+    test_pssm_distribution()
+    test_density_arrays()
+    test_distribution_cache()
+    test_threshold_queries()
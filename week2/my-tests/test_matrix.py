@@ -56,5 +56,67 @@ def test_matrix_functionality():
     
     print("\nMatrix functionality test completed!")
 
+def test_array_storage():
+    """Test that the letter values are views of one array, like a dict of lists."""
+    import copy
+    import math
+    import pickle
+    print("Testing matrix array storage...")
+    counts = {
+        'A': [2, 1, 0, 1, 7],
+        'C': [1, 2, 3, 0, 1],
+        'G': [0, 1, 1, 2, 1],
+        'T': [1, 0, 0, 1, 1]
+    }
+    fpm = FrequencyPositionMatrix("ACGT", counts)
+    assert fpm.array.shape == (5, 4)
+    assert list(fpm['C']) == counts['C']
+    assert fpm['G', 3] == 2 and fpm['A', 1:3] == (1, 0)
+    assert fpm == counts
+    fpm['T'][0] = 4
+    assert fpm.array[0, 3] == 4
+    fpm['T'] = counts['T']
+    assert fpm == counts
+    pssm = fpm.normalize(pseudocounts=0.5).log_odds({'A': 0.3, 'C': 0.2, 'G': 0.2, 'T': 0.3})
+    for matrix in (fpm, fpm.normalize(), pssm):
+        clone = pickle.loads(pickle.dumps(matrix))
+        assert type(clone) is type(matrix) and clone == matrix
+        assert copy.deepcopy(matrix) == matrix
+        clone['A'] = [-1] * clone.length
+        assert clone.array[0, 0] == -1 and clone != matrix
+    # letter values are arrays: + and == work element-wise, not like lists
+    assert list(fpm['A'] + fpm['C']) == [3, 3, 3, 1, 8]
+    assert list(fpm['A']) + list(fpm['C']) == counts['A'] + counts['C']
+    assert (fpm['A'] == counts['A']).all()
+    # the columns of a PWM are read-only, like the tuples they replace
+    pwm = fpm.normalize()
+    clone = pickle.loads(pickle.dumps(pwm))
+    for matrix in (pwm, clone, copy.deepcopy(pwm)):
+        try:
+            matrix['A'][0] = 99
+        except ValueError:
+            pass
+        else:
+            assert False, 'a PWM column should be read-only'
+        assert matrix['A', 0] == 2 / 4
+    # the vectorized reductions against loops over the letters
+    columns = [[pssm[letter][i] for letter in "ACGT"] for i in range(pssm.length)]
+    assert math.isclose(pssm.max, sum(max(column) for column in columns))
+    assert math.isclose(pssm.min, sum(min(column) for column in columns))
+    assert str(pssm.consensus) == "".join("ACGT"[column.index(max(column))] for column in columns)
+    assert str(pssm.anticonsensus) == "".join("ACGT"[column.index(min(column))] for column in columns)
+    background = {'A': 0.3, 'C': 0.2, 'G': 0.2, 'T': 0.3}
+    sx = sxx = 0.0
+    for column in columns:
+        mean = sum(background[letter] * 2 ** lo * lo for letter, lo in zip("ACGT", column))
+        sx += mean
+        sxx += sum(background[letter] * 2 ** lo * lo * lo for letter, lo in zip("ACGT", column)) - mean * mean
+    assert math.isclose(pssm.mean(background), sx)
+    assert math.isclose(pssm.std(background), math.sqrt(sxx))
+    assert math.isclose(fpm.gc_content, 12 / 26)
+    print("✓ matrix values are array views")
+
+
 if __name__ == "__main__":
-    test_matrix_functionality()
\ No newline at end of file
+    test_matrix_functionality()
+    test_array_storage()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Test PSSM scoring and searching against straightforward reference loops.
+"""
+
+import sys
+import os
+# Add the src directory to the Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import numpy as np
+from matrix import FrequencyPositionMatrix, MotifScanner
+
+
+def make_pssm(length=8, seed=1):
+    rng = np.random.default_rng(seed)
+    counts = {letter: list(rng.integers(0, 20, length)) for letter in "ACGT"}
+    return FrequencyPositionMatrix("ACGT", counts).normalize(pseudocounts=0.5).log_odds()
+
+
+def make_sharp_pssm(length, seed=3):
+    """Return a PSSM with a strong consensus, like most real motifs."""
+    rng = np.random.default_rng(seed)
+    counts = rng.dirichlet([0.3] * 4, size=length) * 20
+    counts = {letter: list(counts[:, i]) for i, letter in enumerate("ACGT")}
+    return FrequencyPositionMatrix("ACGT", counts).normalize(pseudocounts=0.5).log_odds()
+
+
+def make_sequence(length, seed=2):
+    rng = np.random.default_rng(seed)
+    return "".join(rng.choice(list("ACGTacgt"), size=length))
+
+
+def reference_scores(pssm, sequence):
+    """Score every window with the plain double loop the fallback used to run."""
+    m = pssm.length
+    scores = []
+    for i in range(len(sequence) - m + 1):
+        score = 0.0
+        for j in range(m):
+            nucleotide = sequence[i + j].upper()
+            if nucleotide in "ACGT":
+                score += pssm[nucleotide][j]
+            else:
+                score = float("nan")
+                break
+        scores.append(score)
+    return np.array(scores, dtype=np.float32)
+
+
+def test_calculate():
+    """Test the vectorized scoring, including ambiguous bases and mixed case."""
+    print("Testing PSSM.calculate...")
+    pssm = make_pssm()
+    sequence = make_sequence(500)
+    sequence = sequence[:100] + "NRY" + sequence[100:]
+    scores = pssm.calculate(sequence)
+    expected = reference_scores(pssm, sequence)
+    assert scores.dtype == np.float32
+    assert np.array_equal(scores, expected, equal_nan=True)
+    assert np.isnan(scores[100])
+    # a window as long as the motif gives a single score
+    window = sequence[:pssm.length]
+    assert pssm.calculate(window) == expected[0]
+    assert len(pssm.calculate(sequence[:3])) == 0
+    print("✓ calculate matches the reference loop")
+
+
+def test_search_both_strands():
+    """Test that search merges both strands by position, across chunks."""
+    print("Testing PSSM.search on both strands...")
+    pssm = make_pssm(10)
+    rc = pssm.reverse_complement()
+    sequence = make_sequence(2000) + "N" + make_sequence(500, seed=3)
+    n = len(sequence)
+    forward = pssm.calculate(sequence)
+    reverse = rc.calculate(sequence)
+    expected = []
+    for position in range(len(forward)):
+        if forward[position] >= 2.0:
+            expected.append((position, forward[position]))
+        if reverse[position] >= 2.0:
+            expected.append((position - n, reverse[position]))
+    for chunksize in (10**6, 333, 1):
+        hits = list(pssm.search(sequence, 2.0, chunksize=chunksize))
+        assert hits == expected
+    assert list(pssm.search(sequence, 2.0, both=False)) == [
+        hit for hit in expected if hit[0] >= 0
+    ]
+    print(f"✓ search found {len(expected)} hits in positional order")
+
+
+def search_hits(pssm, sequence, threshold):
+    """Convert the hits of PSSM.search to (position, strand, score)."""
+    hits = []
+    for position, score in pssm.search(sequence, threshold):
+        if position < 0:
+            hits.append((position + len(sequence), "-", score))
+        else:
+            hits.append((position, "+", score))
+    return hits
+
+
+def test_motif_scanner():
+    """Test that scanning many motifs at once finds the hits of each search."""
+    print("Testing MotifScanner...")
+    pssms = [make_pssm(length, seed=length) for length in (5, 8, 12)]
+    sequence = make_sequence(3000)
+    sequence = sequence[:1000] + "NN" + sequence[1000:]
+    thresholds = [3.0, 4.0, 5.0]
+    scanner = MotifScanner(pssms)
+    hits = list(scanner.search(sequence, thresholds, chunksize=700))
+    assert hits == sorted(hits, key=lambda hit: (hit[1], pssms.index(hit[0]), hit[2]))
+    for pssm, threshold in zip(pssms, thresholds):
+        found = [(hit[1], hit[2], hit[3]) for hit in hits if hit[0] is pssm]
+        expected = search_hits(pssm, sequence, threshold)
+        assert sorted(found) == sorted(expected)
+        assert len(found) > 0
+    # forward strand only, with the hits that reach the end of the sequence
+    scanner = MotifScanner(pssms[:1], both=False)
+    hits = [(position, score) for _, position, _, score in scanner.search(sequence, 0.0)]
+    assert hits == list(pssms[0].search(sequence, 0.0, both=False))
+    print(f"✓ MotifScanner found the same hits as {len(pssms)} separate searches")
+
+
+def test_parallel_search():
+    """Test that a process pool finds the hits of a serial search, in order."""
+    print("Testing parallel search...")
+    pssms = [make_pssm(length, seed=length) for length in (6, 9)]
+    sequence = make_sequence(5000)
+    scanner = MotifScanner(pssms)
+    serial = list(scanner.search(sequence, 3.0, chunksize=400))
+    parallel = list(scanner.search(sequence, 3.0, chunksize=400, workers=2))
+    assert parallel == serial
+    assert list(pssms[0].search(sequence, 3.0, chunksize=1000, workers=3)) == list(
+        pssms[0].search(sequence, 3.0)
+    )
+    print(f"✓ parallel search found the same {len(serial)} hits")
+
+
+def test_lookahead_search():
+    """Test that abandoning hopeless windows early finds exactly the same hits."""
+    print("Testing lookahead search...")
+    sequence = make_sequence(20000)
+    sequence = sequence[:5000] + "NNN" + sequence[5000:]
+    for pssm in (make_pssm(8), make_sharp_pssm(20)):
+        for fraction in (0.3, 0.6, 0.8):
+            threshold = fraction * pssm.max
+            expected = list(pssm.search(sequence, threshold, chunksize=7000))
+            hits = pssm.search(sequence, threshold, chunksize=7000, lookahead=True)
+            assert list(hits) == expected
+        # a threshold equal to a score reached in the sequence keeps that hit
+        threshold = float(expected[len(expected) // 2][1]) if expected else pssm.max
+        assert list(pssm.search(sequence, threshold, lookahead=True)) == list(
+            pssm.search(sequence, threshold)
+        )
+    pssms = [make_pssm(6), make_sharp_pssm(12), make_sharp_pssm(20, seed=4)]
+    scanner = MotifScanner(pssms)
+    thresholds = [0.7 * pssm.max for pssm in pssms]
+    assert list(scanner.search(sequence, thresholds, lookahead=True)) == list(
+        scanner.search(sequence, thresholds)
+    )
+    print("✓ lookahead search found the same hits")
+
+
+def test_search_pvalues():
+    """Test that hits carry the p-values of their scores and can be filtered."""
+    print("Testing search with p-values...")
+    sequence = make_sequence(20000)
+    pssm = make_sharp_pssm(10)
+    distribution = pssm.distribution(precision=200)
+    hits = list(pssm.search(sequence, 2.0, distribution=distribution))
+    assert [hit[:2] for hit in hits] == list(pssm.search(sequence, 2.0))
+    for position, score, pvalue in hits:
+        assert pvalue == distribution.pvalue(score)
+    # filtering by p-value alone keeps exactly the hits below max_pvalue
+    everything = list(pssm.search(sequence, -np.inf, distribution=distribution))
+    for max_pvalue in (1e-2, 1e-4):
+        hits = list(
+            pssm.search(sequence, -np.inf, distribution=distribution, max_pvalue=max_pvalue)
+        )
+        assert hits == [hit for hit in everything if hit[2] <= max_pvalue]
+        assert len(hits) > 0
+    # several motifs, each with its own distribution and cutoff
+    pssms = [make_pssm(6), make_sharp_pssm(8)]
+    distributions = [other.distribution(precision=100) for other in pssms]
+    scanner = MotifScanner(pssms)
+    hits = list(
+        scanner.search(sequence, -np.inf, distributions=distributions, max_pvalue=[1e-2, 1e-3])
+    )
+    for motif, position, strand, score, pvalue in hits:
+        index = pssms.index(motif)
+        assert pvalue == distributions[index].pvalue(score)
+        assert pvalue <= [1e-2, 1e-3][index]
+    count = sum(
+        1
+        for motif, _, _, score in scanner.search(sequence, -np.inf)
+        if distributions[pssms.index(motif)].pvalue(score) <= [1e-2, 1e-3][pssms.index(motif)]
+    )
+    assert len(hits) == count
+    print(f"✓ {len(hits)} hits passed their p-value cutoffs")
+
+
+if __name__ == "__main__":
+    test_calculate()
+    test_search_both_strands()
+    test_motif_scanner()
+    test_parallel_search()
+    test_lookahead_search()
+    test_search_pvalues()
@@ -12,7 +12,9 @@ and position-specific scoring matrices.
 """
 
 import math
+import multiprocessing
 import numbers
+from multiprocessing import shared_memory
 
 import numpy as np
 
@@ -25,8 +27,81 @@ except ImportError:
     _pwm = None  # Fallback when C extension is not available
 
 
+# Row of each nucleotide in the log-odds matrix, indexed by byte value; any
+# other byte maps to row 4, which holds NaN.
+_BASE_INDEX = np.full(256, 4, dtype=np.intp)
+for _index, _letter in enumerate("ACGT"):
+    _BASE_INDEX[ord(_letter)] = _index
+    _BASE_INDEX[ord(_letter.lower())] = _index
+
+
+def _calculate(sequence, logodds, scores):
+    """Fill scores with the PWM score of every window of sequence (NumPy version).
+
+    This is the fallback for _pwm.calculate when the C extension is missing,
+    and takes the same arguments. Each window is summed column by column in
+    double precision, in the same order as the C code, so the float32 scores
+    are identical; windows containing an ambiguous base score NaN.
+    """
+    m = len(logodds)
+    n = len(scores)
+    if n == 0:
+        return
+    table = np.empty((m, 5))
+    table[:, :4] = logodds
+    table[:, 4] = np.nan
+    indices = _BASE_INDEX[np.frombuffer(sequence, dtype=np.uint8)]
+    total = np.zeros(n)
+    for j in range(m):
+        total += table[j, indices[j : j + n]]
+    scores[:] = total
+
+
+def _sequence_bytes(sequence):
+    """Return a Seq, MutableSeq, string or bytes-like sequence as bytes."""
+    try:
+        return bytes(sequence)
+    except TypeError:  # str
+        try:
+            return bytes(sequence, "ASCII")
+        except TypeError:
+            raise ValueError(
+                "sequence should be a Seq, MutableSeq, string, or bytes-like object"
+            ) from None
+        except UnicodeEncodeError:
+            raise ValueError("sequence should contain ASCII characters only") from None
+    except Exception:
+        raise ValueError(
+            "sequence should be a Seq, MutableSeq, string, or bytes-like object"
+        ) from None
+
+
+def _rebuild_matrix(cls, alphabet, array, state):
+    # used by GenericPositionMatrix.__reduce__ for pickling and copying
+    matrix = cls.__new__(cls)
+    GenericPositionMatrix._set_array(matrix, alphabet, array)
+    matrix.__dict__.update(state)
+    return matrix
+
+
 class GenericPositionMatrix(dict):
-    """Base class for the support of position matrix operations."""
+    """Base class for the support of position matrix operations.
+
+    The values are stored in a single (length x alphabet) float64 NumPy
+    array, self.array, with one column per letter in alphabet order. The
+    matrix is still a dict from each letter to its values, but these are
+    views of the columns of the array, so changing them changes the array.
+
+    Note that m[letter] is therefore a NumPy array rather than a list (or a
+    tuple for a PositionWeightMatrix), which changes how it combines with
+    other values: m["A"] + m["C"] adds element-wise instead of concatenating,
+    and m["A"] == values compares element-wise instead of returning a bool.
+    Use list(m[letter]) for the old behavior. The columns of a
+    PositionWeightMatrix are read-only views, as its tuples were immutable.
+    """
+
+    # whether the letter views handed out can be written through
+    _writable_columns = True
 
     def __init__(self, alphabet, values):
         """Initialize the class."""
@@ -36,9 +111,49 @@ class GenericPositionMatrix(dict):
                 self.length = len(values[letter])
             elif self.length != len(values[letter]):
                 raise Exception("data has inconsistent lengths")
-            # Cast any numpy floats into Python floats:
-            self[letter] = [float(_) for _ in values[letter]]
+        array = np.empty((self.length or 0, len(alphabet)))
+        for i, letter in enumerate(alphabet):
+            array[:, i] = values[letter]
+        self._set_array(alphabet, array)
+
+    def _set_array(self, alphabet, array):
         self.alphabet = alphabet
+        self.length = len(array) if len(alphabet) else None
+        self.array = array
+        for i, letter in enumerate(alphabet):
+            column = array[:, i]
+            column.flags.writeable = self._writable_columns
+            dict.__setitem__(self, letter, column)
+
+    def __setitem__(self, letter, values):
+        """Replace the values of a letter in the matrix."""
+        try:
+            i = self.alphabet.index(letter)
+        except ValueError:
+            raise KeyError(letter) from None
+        self.array[:, i] = values
+
+    def __reduce__(self):
+        state = self.__dict__.copy()
+        del state["array"]
+        return (_rebuild_matrix, (self.__class__, self.alphabet, self.array, state))
+
+    def __eq__(self, other):
+        if isinstance(other, GenericPositionMatrix):
+            return self.alphabet == other.alphabet and np.array_equal(
+                self.array, other.array
+            )
+        if isinstance(other, dict):
+            return self.keys() == other.keys() and all(
+                list(self[letter]) == list(other[letter]) for letter in self
+            )
+        return NotImplemented
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
 
     def __str__(self):
         """Return a string containing nucleotides and counts of the alphabet in the Matrix."""
@@ -140,30 +255,17 @@ class GenericPositionMatrix(dict):
     @property
     def consensus(self):
         """Return the consensus sequence."""
-        sequence = ""
-        for i in range(self.length):
-            maximum = -math.inf
-            for letter in self.alphabet:
-                count = self[letter][i]
-                if count > maximum:
-                    maximum = count
-                    sequence_letter = letter
-            sequence += sequence_letter
-        return Seq(sequence)
+        # the first letter with the highest value, ignoring NaN
+        array = np.where(np.isnan(self.array), -math.inf, self.array)
+        indices = np.argmax(array, axis=1)
+        return Seq("".join(self.alphabet[i] for i in indices))
 
     @property
     def anticonsensus(self):
         """Return the anticonsensus sequence."""
-        sequence = ""
-        for i in range(self.length):
-            minimum = math.inf
-            for letter in self.alphabet:
-                count = self[letter][i]
-                if count < minimum:
-                    minimum = count
-                    sequence_letter = letter
-            sequence += sequence_letter
-        return Seq(sequence)
+        array = np.where(np.isnan(self.array), math.inf, self.array)
+        indices = np.argmin(array, axis=1)
+        return Seq("".join(self.alphabet[i] for i in indices))
 
     @property
     def degenerate_consensus(self):
@@ -292,15 +394,8 @@ class GenericPositionMatrix(dict):
     @property
     def gc_content(self):
         """Compute the fraction GC content."""
-        alphabet = self.alphabet
-        gc_total = 0.0
-        total = 0.0
-        for i in range(self.length):
-            for letter in alphabet:
-                if letter in "CG":
-                    gc_total += self[letter][i]
-                total += self[letter][i]
-        return gc_total / total
+        gc = [i for i, letter in enumerate(self.alphabet) if letter in "CG"]
+        return float(self.array[:, gc].sum() / self.array.sum())
 
     def reverse_complement(self):
         """Compute reverse complement."""
@@ -332,19 +427,14 @@ class FrequencyPositionMatrix(GenericPositionMatrix):
         Alternatively, the pseudocounts can be a dictionary with a key
         for each letter in the alphabet associated with the motif.
         """
-        counts = {}
         if pseudocounts is None:
-            for letter in self.alphabet:
-                counts[letter] = [0.0] * self.length
+            counts = self.array + 0.0
         elif isinstance(pseudocounts, dict):
-            for letter in self.alphabet:
-                counts[letter] = [float(pseudocounts[letter])] * self.length
+            pseudocounts = [float(pseudocounts[letter]) for letter in self.alphabet]
+            counts = self.array + pseudocounts
         else:
-            for letter in self.alphabet:
-                counts[letter] = [float(pseudocounts)] * self.length
-        for i in range(self.length):
-            for letter in self.alphabet:
-                counts[letter][i] += self[letter][i]
+            counts = self.array + float(pseudocounts)
+        counts = {letter: counts[:, i] for i, letter in enumerate(self.alphabet)}
         # Actual normalization is done in the PositionWeightMatrix initializer
         return PositionWeightMatrix(self.alphabet, counts)
 
@@ -352,15 +442,12 @@ class FrequencyPositionMatrix(GenericPositionMatrix):
 class PositionWeightMatrix(GenericPositionMatrix):
     """Class for the support of weight calculations on the Position Matrix."""
 
+    _writable_columns = False
+
     def __init__(self, alphabet, counts):
         """Initialize the class."""
         GenericPositionMatrix.__init__(self, alphabet, counts)
-        for i in range(self.length):
-            total = sum(self[letter][i] for letter in alphabet)
-            for letter in alphabet:
-                self[letter][i] /= total
-        for letter in alphabet:
-            self[letter] = tuple(self[letter])
+        self.array /= self.array.sum(axis=1, keepdims=True)
 
     def log_odds(self, background=None):
         """Return the Position-Specific Scoring Matrix.
@@ -424,47 +511,17 @@ class PositionSpecificScoringMatrix(GenericPositionMatrix):
         # NOTE: The C code handles mixed case input as this could be large
         # (e.g. contig or chromosome), so requiring it be all upper or lower
         # case would impose an overhead to allocate the extra memory.
-        try:
-            sequence = bytes(sequence)
-        except TypeError:  # str
-            try:
-                sequence = bytes(sequence, "ASCII")
-            except TypeError:
-                raise ValueError(
-                    "sequence should be a Seq, MutableSeq, string, or bytes-like object"
-                ) from None
-            except UnicodeEncodeError:
-                raise ValueError(
-                    "sequence should contain ASCII characters only"
-                ) from None
-        except Exception:
-            raise ValueError(
-                "sequence should be a Seq, MutableSeq, string, or bytes-like object"
-            ) from None
+        sequence = _sequence_bytes(sequence)
 
         n = len(sequence)
         m = self.length
         
+        scores = np.empty(max(n - m + 1, 0), np.float32)
+        logodds = self.array[:, [self.alphabet.index(letter) for letter in "ACGT"]]
         if _pwm is None:
-            # Pure Python fallback implementation
-            scores = []
-            for i in range(n - m + 1):
-                score = 0.0
-                for j in range(m):
-                    nucleotide = chr(sequence[i + j]).upper()
-                    if nucleotide in "ACGT":
-                        score += self[nucleotide][j]
-                    else:
-                        score = float('nan')  # Handle ambiguous bases
-                        break
-                scores.append(score)
-            scores = np.array(scores, dtype=np.float32)
+            _calculate(sequence, logodds, scores)
         else:
             # Use C extension for speed
-            scores = np.empty(n - m + 1, np.float32)
-            logodds = np.array(
-                [[self[letter][i] for letter in "ACGT"] for i in range(m)], float
-            )
             _pwm.calculate(sequence, logodds, scores)
 
         if len(scores) == 1:
@@ -472,38 +529,52 @@ class PositionSpecificScoringMatrix(GenericPositionMatrix):
         else:
             return scores
 
-    def search(self, sequence, threshold=0.0, both=True, chunksize=10**6):
+    def search(
+        self,
+        sequence,
+        threshold=0.0,
+        both=True,
+        chunksize=10**6,
+        workers=1,
+        lookahead=False,
+        distribution=None,
+        max_pvalue=None,
+    ):
         """Find hits with PWM score above given threshold.
 
         A generator function, returning found hits in the given sequence
         with the pwm score higher than the threshold.
+
+        Hits are returned as (position, score) tuples ordered by position,
+        with hits on the reverse strand given a negative position (counted
+        from the end of the sequence) and following a forward strand hit at
+        the same position. The matrix and its reverse complement are scored
+        together in a single sweep over each chunk of the sequence. With
+        workers > 1, the chunks are scored in parallel by a process pool,
+        and with lookahead=True windows are abandoned as soon as they can no
+        longer reach the threshold (see MotifScanner.search).
+
+        If the score distribution of this matrix is given (see the
+        distribution method), hits are (position, score, pvalue) tuples
+        instead, with the background p-value of the score, and can be
+        limited to p-values of at most max_pvalue.
         """
-        sequence = sequence.upper()
+        sequence = _sequence_bytes(sequence)
         seq_len = len(sequence)
-        motif_l = self.length
-        chunk_starts = np.arange(0, seq_len, chunksize)
-        if both:
-            rc = self.reverse_complement()
-        for chunk_start in chunk_starts:
-            subseq = sequence[chunk_start : chunk_start + chunksize + motif_l - 1]
-            pos_scores = self.calculate(subseq)
-            pos_ind = pos_scores >= threshold
-            pos_positions = np.where(pos_ind)[0] + chunk_start
-            pos_scores = pos_scores[pos_ind]
-            if both:
-                neg_scores = rc.calculate(subseq)
-                neg_ind = neg_scores >= threshold
-                neg_positions = np.where(neg_ind)[0] + chunk_start
-                neg_scores = neg_scores[neg_ind]
-            else:
-                neg_positions = np.empty((0), dtype=int)
-                neg_scores = np.empty((0), dtype=int)
-            chunk_positions = np.append(pos_positions, neg_positions - seq_len)
-            chunk_scores = np.append(pos_scores, neg_scores)
-            order = np.argsort(np.append(pos_positions, neg_positions))
-            chunk_positions = chunk_positions[order]
-            chunk_scores = chunk_scores[order]
-            yield from zip(chunk_positions, chunk_scores)
+        scanner = MotifScanner([self], both=both)
+        hits = scanner.search(
+            sequence,
+            threshold,
+            chunksize,
+            workers,
+            lookahead,
+            None if distribution is None else [distribution],
+            max_pvalue,
+        )
+        for _, position, strand, score, *pvalue in hits:
+            if strand == "-":
+                position -= seq_len
+            yield (position, score, *pvalue)
 
     @property
     def max(self):
@@ -511,11 +582,7 @@ class PositionSpecificScoringMatrix(GenericPositionMatrix):
 
         returns the score computed for the consensus sequence.
         """
-        score = 0.0
-        letters = self.alphabet
-        for position in range(self.length):
-            score += max(self[letter][position] for letter in letters)
-        return score
+        return float(np.sum(np.fmax.reduce(self.array, axis=1)))
 
     @property
     def min(self):
@@ -523,64 +590,37 @@ class PositionSpecificScoringMatrix(GenericPositionMatrix):
 
         returns the score computed for the anticonsensus sequence.
         """
-        score = 0.0
-        letters = self.alphabet
-        for position in range(self.length):
-            score += min(self[letter][position] for letter in letters)
-        return score
+        return float(np.sum(np.fmin.reduce(self.array, axis=1)))
 
     @property
     def gc_content(self):
         """Compute the GC-ratio."""
         raise Exception("Cannot compute the %GC composition of a PSSM")
 
-    def mean(self, background=None):
-        """Return expected value of the score of a motif."""
+    def _weighted_logodds(self, background):
+        # the log-odds and their probabilities p = b * 2 ** logodds, with
+        # NaN and -inf entries (which have p = 0) set to zero
         if background is None:
             background = dict.fromkeys(self.alphabet, 1.0)
-        else:
-            background = dict(background)
-        total = sum(background.values())
-        for letter in self.alphabet:
-            background[letter] /= total
-        sx = 0.0
-        for i in range(self.length):
-            for letter in self.alphabet:
-                logodds = self[letter, i]
-                if math.isnan(logodds):
-                    continue
-                if math.isinf(logodds) and logodds < 0:
-                    continue
-                b = background[letter]
-                p = b * math.pow(2, logodds)
-                sx += p * logodds
-        return sx
+        b = np.array([background[letter] for letter in self.alphabet], float)
+        b /= b.sum()
+        logodds = self.array
+        valid = ~np.isnan(logodds) & (logodds != -math.inf)
+        logodds = np.where(valid, logodds, 0.0)
+        p = np.where(valid, b * np.exp2(logodds), 0.0)
+        return logodds, p
+
+    def mean(self, background=None):
+        """Return expected value of the score of a motif."""
+        logodds, p = self._weighted_logodds(background)
+        return float(np.sum(p * logodds))
 
     def std(self, background=None):
         """Return standard deviation of the score of a motif."""
-        if background is None:
-            background = dict.fromkeys(self.alphabet, 1.0)
-        else:
-            background = dict(background)
-        total = sum(background.values())
-        for letter in self.alphabet:
-            background[letter] /= total
-        variance = 0.0
-        for i in range(self.length):
-            sx = 0.0
-            sxx = 0.0
-            for letter in self.alphabet:
-                logodds = self[letter, i]
-                if math.isnan(logodds):
-                    continue
-                if math.isinf(logodds) and logodds < 0:
-                    continue
-                b = background[letter]
-                p = b * math.pow(2, logodds)
-                sx += p * logodds
-                sxx += p * logodds * logodds
-            sxx -= sx * sx
-            variance += sxx
+        logodds, p = self._weighted_logodds(background)
+        sx = np.sum(p * logodds, axis=1)
+        sxx = np.sum(p * logodds * logodds, axis=1)
+        variance = np.sum(sxx - sx * sx)
         variance = max(variance, 0)  # to avoid roundoff problems
         return math.sqrt(variance)
 
@@ -605,32 +645,26 @@ class PositionSpecificScoringMatrix(GenericPositionMatrix):
 
     def dist_pearson_at(self, other, offset):
         """Return the similarity score based on pearson correlation at the given offset."""
-        letters = self.alphabet
-        sx = 0.0  # \sum x
-        sy = 0.0  # \sum y
-        sxx = 0.0  # \sum x^2
-        sxy = 0.0  # \sum x \cdot y
-        syy = 0.0  # \sum y^2
-        norm = max(self.length, offset + other.length) * len(letters)
-        for pos in range(min(self.length - offset, other.length)):
-            xi = [self[letter, pos + offset] for letter in letters]
-            yi = [other[letter, pos] for letter in letters]
-            sx += sum(xi)
-            sy += sum(yi)
-            sxx += sum(x * x for x in xi)
-            sxy += sum(x * y for x, y in zip(xi, yi))
-            syy += sum(y * y for y in yi)
-        sx /= norm
-        sy /= norm
-        sxx /= norm
-        sxy /= norm
-        syy /= norm
+        norm = max(self.length, offset + other.length) * len(self.alphabet)
+        n = max(min(self.length - offset, other.length), 0)
+        x = self.array[offset : offset + n]
+        y = other.array[:n]
+        sx = np.sum(x) / norm  # \sum x
+        sy = np.sum(y) / norm  # \sum y
+        sxx = np.sum(x * x) / norm  # \sum x^2
+        sxy = np.sum(x * y) / norm  # \sum x \cdot y
+        syy = np.sum(y * y) / norm  # \sum y^2
         numerator = sxy - sx * sy
         denominator = math.sqrt((sxx - sx * sx) * (syy - sy * sy))
         return numerator / denominator
 
-    def distribution(self, background=None, precision=10**3):
-        """Calculate the distribution of the scores at the given precision."""
+    def distribution(self, background=None, precision=10**3, cache=None):
+        """Calculate the distribution of the scores at the given precision.
+
+        If cache is a thresholds.DistributionCache, the distribution is
+        taken from it when this PSSM, background and precision were seen
+        before, and stored in it otherwise.
+        """
         try:
             from .thresholds import ScoreDistribution
         except ImportError:
@@ -643,4 +677,350 @@ class PositionSpecificScoringMatrix(GenericPositionMatrix):
         total = sum(background.values())
         for letter in self.alphabet:
             background[letter] /= total
+        if cache is not None:
+            return cache.get(self, background, precision)
         return ScoreDistribution(precision=precision, pssm=self, background=background)
+
+
+class MotifScanner:
+    """Scan a DNA sequence with many motifs in a single pass.
+
+    Calling PositionSpecificScoringMatrix.search once per motif encodes the
+    sequence again and recomputes the reverse complement matrix for every
+    motif. A MotifScanner stacks the log-odds matrices of all motifs into one
+    (width x 5 x motifs) array up front, encodes each chunk of the sequence
+    once, and scores every motif on it together. When both strands are
+    scanned, the array is complex, with the reverse complement matrix as the
+    imaginary part, so that one sweep scores both strands. Motifs shorter
+    than the longest one are padded with zero columns; the fifth row of each
+    real column is NaN and scores windows with ambiguous bases.
+
+    The motifs can be given as Motif objects, whose pssm is used, or as
+    PositionSpecificScoringMatrix objects.
+    """
+
+    def __init__(self, motifs, both=True):
+        """Initialize the class."""
+        self.motifs = list(motifs)
+        self.both = both
+        pssms = []
+        for motif in self.motifs:
+            if not isinstance(motif, PositionSpecificScoringMatrix):
+                motif = motif.pssm
+            if sorted(motif.alphabet) != ["A", "C", "G", "T"]:
+                raise ValueError(
+                    "PSSM has wrong alphabet: %s - Use only with DNA motifs"
+                    % motif.alphabet
+                )
+            pssms.append(motif)
+        if not pssms:
+            raise ValueError("MotifScanner needs at least one motif")
+        self.width = max(pssm.length for pssm in pssms)
+        self.lengths = [pssm.length for pssm in pssms]
+        self._lookahead = None
+        self.logodds = np.zeros(
+            (self.width, 5, len(pssms)), dtype=complex if both else float
+        )
+        for i, pssm in enumerate(pssms):
+            m = pssm.length
+            columns = [pssm.alphabet.index(letter) for letter in "ACGT"]
+            # fill the parts separately: 1j * -inf would give a NaN real part
+            self.logodds.real[:m, :4, i] = pssm.array[:, columns]
+            self.logodds.real[:m, 4, i] = np.nan
+            if both:
+                # the reverse complement: positions reversed, and each base
+                # scored as its complement (TGCA is ACGT reversed)
+                self.logodds.imag[:m, :4, i] = pssm.array[::-1, columns[::-1]]
+                self.logodds.imag[:m, 4, i] = np.nan
+
+    def calculate(self, sequence):
+        """Return the scores of all motifs at every position of the sequence.
+
+        The result is a float32 array with one row per position and one
+        column per motif, or two per motif (forward, then reverse strand)
+        when scanning both strands. Windows that run past the end of the
+        sequence for a shorter motif score NaN. Each window is summed in the
+        same order as PositionSpecificScoringMatrix.calculate, so the scores
+        are identical.
+        """
+        sequence = _sequence_bytes(sequence)
+        n = len(sequence)
+        indices = np.full(n + self.width - 1, 4, dtype=np.intp)
+        indices[:n] = _BASE_INDEX[np.frombuffer(sequence, dtype=np.uint8)]
+        logodds = self.logodds
+        if logodds.shape[2] == 1:
+            # gathering scalars is much faster than gathering rows of one
+            logodds = logodds[:, :, 0]
+        n_columns = self.logodds.shape[2] * (2 if self.both else 1)
+        scores = np.empty((n, n_columns), np.float32)
+        # sum in blocks small enough for the running totals to stay in the
+        # CPU cache, which is several times faster than one long sweep
+        block = max(2**15 // n_columns, 512)
+        for start in range(0, n, block):
+            stop = min(start + block, n)
+            total = np.zeros((stop - start,) + logodds.shape[2:], logodds.dtype)
+            for j in range(self.width):
+                total += logodds[j][indices[start + j : stop + j]]
+            # a complex total views as its forward and reverse parts in turn
+            scores[start:stop] = total.view(float).reshape(stop - start, n_columns)
+        return scores
+
+    def _scan(self, chunk, thresholds, chunksize, lookahead=False):
+        # positions, score columns and scores of the hits in one chunk
+        if lookahead:
+            return self._scan_lookahead(chunk, thresholds, chunksize)
+        scores = self.calculate(chunk)[:chunksize]
+        positions, columns = np.nonzero(scores >= thresholds)
+        return positions, columns, scores[positions, columns]
+
+    def _lookahead_plans(self):
+        """Return the column order and score bounds for a lookahead scan.
+
+        There is one plan per score column (motif and strand), a tuple of its
+        log-odds table, its columns ordered by decreasing information content
+        (against a uniform background), and the highest score the columns
+        after each step of that order can still add.
+        """
+        if self._lookahead is None:
+            self._lookahead = []
+            parts = [self.logodds.real]
+            if self.both:
+                parts.append(self.logodds.imag)
+            for i, m in enumerate(self.lengths):
+                for part in parts:
+                    table = np.ascontiguousarray(part[:m, :, i])
+                    logodds = table[:, :4]
+                    finite = np.isfinite(logodds)
+                    weights = np.where(finite, 0.25 * np.exp2(logodds), 0.0)
+                    content = np.sum(weights * np.where(finite, logodds, 0.0), axis=1)
+                    order = np.argsort(-content, kind="stable")
+                    best = np.max(np.where(np.isnan(logodds), -np.inf, logodds), axis=1)
+                    remaining = np.append(np.cumsum(best[order][::-1])[::-1], 0.0)
+                    self._lookahead.append((table, order, remaining[1:]))
+        return self._lookahead
+
+    def _scan_lookahead(self, chunk, thresholds, chunksize):
+        # Score the columns of each matrix in order of information content,
+        # dropping a window as soon as its partial score plus the best the
+        # remaining columns can add falls below the threshold. The survivors
+        # are then rescored in the usual column order, so scores and hits
+        # are identical to a full scan; the bound is loosened slightly so
+        # that rounding in the reordered sums cannot drop a true hit.
+        chunk = _sequence_bytes(chunk)
+        n = min(len(chunk), chunksize)
+        indices = np.full(n + self.width - 1, 4, dtype=np.intp)
+        indices[: len(chunk)] = _BASE_INDEX[np.frombuffer(chunk, dtype=np.uint8)]
+        block = 2**16
+        hits = []
+        for column, (table, order, remaining) in enumerate(self._lookahead_plans()):
+            threshold = thresholds[column]
+            cutoff = float(threshold) - 1e-6 * (1.0 + abs(float(threshold)))
+            for start in range(0, n, block):
+                stop = min(start + block, n)
+                # while many windows survive, add whole columns of the block
+                partial = np.zeros(stop - start)
+                for step, j in enumerate(order):
+                    partial += table[j][indices[start + j : stop + j]]
+                    keep = partial >= cutoff - remaining[step]
+                    if np.count_nonzero(keep) * 8 < len(keep):
+                        break
+                windows = np.flatnonzero(keep)
+                partial = partial[windows]
+                windows += start
+                # then follow the few survivors one column at a time
+                for step in range(step + 1, len(order)):
+                    if len(windows) == 0:
+                        break
+                    j = order[step]
+                    partial += table[j][indices[windows + j]]
+                    keep = partial >= cutoff - remaining[step]
+                    windows = windows[keep]
+                    partial = partial[keep]
+                total = np.zeros(len(windows))
+                for j in range(len(table)):
+                    total += table[j][indices[windows + j]]
+                scores = total.astype(np.float32)
+                keep = scores >= threshold
+                columns = np.full(np.count_nonzero(keep), column)
+                hits.append((windows[keep], columns, scores[keep]))
+        positions, columns, scores = (np.concatenate(part) for part in zip(*hits))
+        order = np.lexsort((columns, positions))
+        return positions[order], columns[order], scores[order]
+
+    def search(
+        self,
+        sequence,
+        threshold=0.0,
+        chunksize=None,
+        workers=1,
+        lookahead=False,
+        distributions=None,
+        max_pvalue=None,
+    ):
+        """Find hits of all motifs with a score above the given threshold.
+
+        A generator function, yielding (motif, position, strand, score) for
+        every hit, where position is the start of the hit on the forward
+        strand and strand is "+" or "-". The threshold is a single number or
+        one number per motif. Hits are ordered by position, then by the order
+        of the motifs, with the forward strand first.
+
+        The sequence is scored chunksize positions at a time; by default,
+        chunks are sized to keep their scores (4 bytes per position and
+        matrix) at about 4 MB.
+
+        With workers > 1, the chunks are scored by a pool of that many
+        processes. The sequence is copied once into shared memory, which
+        the workers read their chunks from, and only the hits are sent
+        back; they are yielded in the same order as by a serial search.
+
+        With lookahead=True, windows are abandoned as soon as the columns
+        scored so far, visited in order of information content, plus the
+        best score of the remaining columns can no longer reach the
+        threshold. This finds the same hits, and is much faster for long
+        motifs with a stringent threshold, as most windows are dropped after
+        a few columns.
+
+        If distributions gives the ScoreDistribution of each motif (see
+        PositionSpecificScoringMatrix.distribution), every hit gets its
+        background p-value as a fifth element, looked up for all hits of a
+        chunk at once in the tail sums of the distributions. Hits can then
+        also be limited to a max_pvalue (a single number or one per motif),
+        in addition to the score threshold.
+        """
+        sequence = _sequence_bytes(sequence)
+        strands = 2 if self.both else 1
+        thresholds = np.broadcast_to(
+            np.asarray(threshold, dtype=np.float32), (len(self.motifs),)
+        )
+        if distributions is not None:
+            tails = _TailTable(distributions, len(self.motifs))
+            if max_pvalue is not None:
+                max_pvalues = np.broadcast_to(
+                    np.asarray(max_pvalue, dtype=float), (len(self.motifs),)
+                )
+                thresholds = np.maximum(thresholds, tails.min_scores(max_pvalues))
+        elif max_pvalue is not None:
+            raise ValueError("max_pvalue needs the distributions of the motifs")
+        thresholds = np.repeat(thresholds, strands)
+        if chunksize is None:
+            chunksize = max(2**20 // (self.logodds.shape[2] * strands), self.width)
+        chunk_starts = range(0, len(sequence), chunksize)
+        if workers > 1 and len(chunk_starts) > 1:
+            results = self._scan_parallel(
+                sequence, thresholds, chunksize, workers, lookahead
+            )
+        else:
+            results = (
+                self._scan(
+                    sequence[chunk_start : chunk_start + chunksize + self.width - 1],
+                    thresholds,
+                    chunksize,
+                    lookahead,
+                )
+                for chunk_start in chunk_starts
+            )
+        for chunk_start, (positions, columns, scores) in zip(chunk_starts, results):
+            if distributions is None:
+                for position, column, score in zip(
+                    positions.tolist(), columns.tolist(), scores
+                ):
+                    yield (
+                        self.motifs[column // strands],
+                        chunk_start + position,
+                        "-" if column % strands else "+",
+                        score,
+                    )
+                continue
+            motifs = columns // strands
+            pvalues = tails.pvalues(motifs, scores)
+            if max_pvalue is not None:
+                keep = pvalues <= max_pvalues[motifs]
+                positions, columns = positions[keep], columns[keep]
+                scores, pvalues = scores[keep], pvalues[keep]
+            for position, column, score, pvalue in zip(
+                positions.tolist(), columns.tolist(), scores, pvalues.tolist()
+            ):
+                yield (
+                    self.motifs[column // strands],
+                    chunk_start + position,
+                    "-" if column % strands else "+",
+                    score,
+                    pvalue,
+                )
+
+    def _scan_parallel(self, sequence, thresholds, chunksize, workers, lookahead):
+        # yields the hits of every chunk in order, scored by a process pool
+        memory = shared_memory.SharedMemory(create=True, size=max(len(sequence), 1))
+        try:
+            memory.buf[: len(sequence)] = sequence
+            if lookahead:
+                self._lookahead_plans()
+            initargs = (
+                self, memory.name, len(sequence), thresholds, chunksize, lookahead
+            )
+            with multiprocessing.Pool(workers, _init_scan_worker, initargs) as pool:
+                chunk_starts = range(0, len(sequence), chunksize)
+                yield from pool.imap(_scan_worker_chunk, chunk_starts)
+        finally:
+            memory.close()
+            memory.unlink()
+
+
+class _TailTable:
+    """Background p-values of the scores of several motifs.
+
+    The tail sums of the ScoreDistribution of every motif are concatenated
+    into one array, so the p-values of the hits of all motifs are looked up
+    together, rounding scores to the nearest point as in
+    ScoreDistribution.pvalue.
+    """
+
+    def __init__(self, distributions, n_motifs):
+        distributions = list(distributions)
+        if len(distributions) != n_motifs:
+            raise ValueError("expected one score distribution per motif")
+        tails = [distribution._cumulative()[0] for distribution in distributions]
+        self.tails = np.concatenate(tails)
+        self.offsets = np.cumsum([0] + [len(tail) for tail in tails[:-1]])
+        self.n_points = np.array([len(tail) - 1 for tail in tails])
+        self.bottoms = np.array([float(d.min_score) for d in distributions])
+        self.steps = np.array([float(d.step) for d in distributions])
+
+    def pvalues(self, motifs, scores):
+        """Return the p-values of the scores of the given motifs."""
+        x = np.asarray(scores, dtype=float) - self.bottoms[motifs]
+        steps = self.steps[motifs]
+        i = np.clip(np.floor_divide(x + 0.5 * steps, steps), 0, self.n_points[motifs])
+        return self.tails[self.offsets[motifs] + i.astype(int)]
+
+    def min_scores(self, max_pvalues):
+        """Return a score below which no p-value is at most max_pvalues.
+
+        This is one point below the lowest point with a small enough
+        p-value, which leaves room for the rounding of scores to points.
+        """
+        scores = np.empty(len(max_pvalues), dtype=np.float32)
+        for motif, max_pvalue in enumerate(max_pvalues):
+            start = self.offsets[motif]
+            tail = self.tails[start : start + self.n_points[motif] + 1]
+            first = np.count_nonzero(tail > max_pvalue)
+            scores[motif] = self.bottoms[motif] + (first - 1) * self.steps[motif]
+        return scores
+
+
+# State of a MotifScanner.search worker process, set by _init_scan_worker
+_scan_worker = None
+
+
+def _init_scan_worker(scanner, name, size, thresholds, chunksize, lookahead):
+    global _scan_worker
+    memory = shared_memory.SharedMemory(name=name)
+    _scan_worker = (scanner, memory, size, thresholds, chunksize, lookahead)
+
+
+def _scan_worker_chunk(chunk_start):
+    scanner, memory, size, thresholds, chunksize, lookahead = _scan_worker
+    stop = min(chunk_start + chunksize + scanner.width - 1, size)
+    chunk = memory.buf[chunk_start:stop]
+    return scanner._scan(chunk, thresholds, chunksize, lookahead)
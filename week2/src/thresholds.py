@@ -5,6 +5,13 @@
 # as part of this package.
 """Approximate calculation of appropriate thresholds for motif finding."""
 
+import hashlib
+import os
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
 
 class ScoreDistribution:
     """Class representing approximate score distribution for a given motif.
@@ -12,8 +19,18 @@ class ScoreDistribution:
     Utilizes a dynamic programming approach to calculate the distribution of
     scores with a predefined precision. Provides a number of methods for calculating
     thresholds for motif occurrences.
+
+    The densities are NumPy arrays of n_points bins. Each motif position
+    shifts the densities by the score of every letter and adds them up,
+    weighted by the letter probabilities, as whole-array operations.
+
+    Threshold and p-value queries are answered by binary search over the
+    cumulative sums of the densities, which are computed on first use.
     """
 
+    # cumulative sums of the densities, see _cumulative
+    _tables = None
+
     def __init__(self, motif=None, precision=10**3, pssm=None, background=None):
         """Initialize the class."""
         if pssm is None:
@@ -27,77 +44,132 @@ class ScoreDistribution:
             self.n_points = precision * pssm.length
             self.ic = pssm.mean(background)
         self.step = self.interval / (self.n_points - 1)
-        self.mo_density = [0.0] * self.n_points
+        self.mo_density = np.zeros(self.n_points)
         self.mo_density[-self._index_diff(self.min_score)] = 1.0
-        self.bg_density = [0.0] * self.n_points
-        self.bg_density[-self._index_diff(self.min_score)] = 1.0
+        self.bg_density = self.mo_density.copy()
         if pssm is None:
             for lo, mo in zip(motif.log_odds(), motif.pwm()):
                 self.modify(lo, mo, motif.background)
         else:
             for position in range(pssm.length):
-                mo_new = [0.0] * self.n_points
-                bg_new = [0.0] * self.n_points
                 lo = pssm[:, position]
-                for letter, score in lo.items():
-                    bg = background[letter]
-                    mo = pow(2, pssm[letter, position]) * bg
-                    d = self._index_diff(score)
-                    for i in range(self.n_points):
-                        mo_new[self._add(i, d)] += self.mo_density[i] * mo
-                        bg_new[self._add(i, d)] += self.bg_density[i] * bg
-                self.mo_density = mo_new
-                self.bg_density = bg_new
+                mo = {
+                    letter: pow(2, score) * background[letter]
+                    for letter, score in lo.items()
+                }
+                self.modify(lo, mo, background)
 
     def _index_diff(self, x, y=0.0):
         return int((x - y + 0.5 * self.step) // self.step)
 
-    def _add(self, i, j):
-        return max(0, min(self.n_points - 1, i + j))
+    def _shift_add(self, new, density, d, weight):
+        # new[i + d] += density[i] * weight for all i, where any i + d past
+        # either end of the array goes to the first or last point
+        n = self.n_points
+        if d >= 0:
+            if d >= n:
+                new[-1] += density.sum() * weight
+            else:
+                new[d:] += density[: n - d] * weight
+                new[-1] += density[n - d :].sum() * weight
+        else:
+            d = -d
+            if d >= n:
+                new[0] += density.sum() * weight
+            else:
+                new[: n - d] += density[d:] * weight
+                new[0] += density[:d].sum() * weight
 
     def modify(self, scores, mo_probs, bg_probs):
         """Modify motifs and background density."""
-        mo_new = [0.0] * self.n_points
-        bg_new = [0.0] * self.n_points
+        self._tables = None
+        mo_new = np.zeros(self.n_points)
+        bg_new = np.zeros(self.n_points)
         for k, v in scores.items():
             d = self._index_diff(v)
-            for i in range(self.n_points):
-                mo_new[self._add(i, d)] += self.mo_density[i] * mo_probs[k]
-                bg_new[self._add(i, d)] += self.bg_density[i] * bg_probs[k]
+            self._shift_add(mo_new, self.mo_density, d, mo_probs[k])
+            self._shift_add(bg_new, self.bg_density, d, bg_probs[k])
         self.mo_density = mo_new
         self.bg_density = bg_new
 
+    def _cumulative(self):
+        # Running sums of the densities, indexed by bin i = 0..n_points:
+        #   bg_tail[i] = FPR of threshold i, the background mass at or above i
+        #   mo_head[i] = the motif mass below i
+        #   mo_rest[i] = FNR of threshold i, computed as 1 - mo_density[-1]
+        #                - mo_density[-2] - ... - mo_density[i]
+        # Each is accumulated in the same order as the loops that used to
+        # walk the densities, so the thresholds found are the same. The
+        # arrays are monotonic, which lets every query use binary search.
+        if self._tables is None:
+            bg_tail = np.append(np.cumsum(self.bg_density[::-1])[::-1], 0.0)
+            mo_head = np.concatenate(([0.0], np.cumsum(self.mo_density)))
+            mo_rest = np.subtract.accumulate(
+                np.concatenate(([1.0], self.mo_density[::-1]))
+            )[::-1]
+            self._tables = bg_tail, mo_head, mo_rest
+        return self._tables
+
+    def _score(self, i):
+        scores = self.min_score + np.asarray(i) * self.step
+        if scores.ndim == 0:
+            return float(scores)
+        return scores
+
     def threshold_fpr(self, fpr):
-        """Approximate the log-odds threshold which makes the type I error (false positive rate)."""
-        i = self.n_points
-        prob = 0.0
-        while prob < fpr:
-            i -= 1
-            prob += self.bg_density[i]
-        return self.min_score + i * self.step
+        """Approximate the log-odds threshold which makes the type I error (false positive rate).
+
+        fpr can also be an array of rates, giving an array of thresholds.
+        """
+        bg_tail = self._cumulative()[0]
+        # highest i with bg_tail[i] >= fpr; bg_tail[::-1] is ascending
+        i = self.n_points - np.searchsorted(bg_tail[::-1], fpr)
+        return self._score(np.maximum(i, 0))
 
     def threshold_fnr(self, fnr):
-        """Approximate the log-odds threshold which makes the type II error (false negative rate)."""
-        i = -1
-        prob = 0.0
-        while prob < fnr:
-            i += 1
-            prob += self.mo_density[i]
-        return self.min_score + i * self.step
+        """Approximate the log-odds threshold which makes the type II error (false negative rate).
+
+        fnr can also be an array of rates, giving an array of thresholds.
+        """
+        mo_head = self._cumulative()[1]
+        # lowest i with mo_head[i + 1] >= fnr
+        i = np.searchsorted(mo_head, fnr) - 1
+        return self._score(np.minimum(i, self.n_points - 1))
 
     def threshold_balanced(self, rate_proportion=1.0, return_rate=False):
         """Approximate log-odds threshold making FNR equal to FPR times rate_proportion."""
-        i = self.n_points
-        fpr = 0.0
-        fnr = 1.0
-        while fpr * rate_proportion < fnr:
-            i -= 1
-            fpr += self.bg_density[i]
-            fnr -= self.mo_density[i]
+        bg_tail, mo_head, mo_rest = self._cumulative()
+        # highest i with bg_tail[i] * rate_proportion >= mo_rest[i]; the
+        # condition only gets weaker as i decreases
+        low, high = 0, self.n_points - 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            if bg_tail[middle] * rate_proportion < mo_rest[middle]:
+                high = middle - 1
+            else:
+                low = middle
         if return_rate:
-            return self.min_score + i * self.step, fpr
+            return self._score(low), float(bg_tail[low])
         else:
-            return self.min_score + i * self.step
+            return self._score(low)
+
+    def pvalue(self, score):
+        """Return the probability of a background score at least this high.
+
+        This is the false positive rate of score used as a threshold, and the
+        inverse of threshold_fpr. Scores are rounded to the nearest point of
+        the distribution. score can also be an array of scores, giving an
+        array of p-values. A NaN score, as PSSM.calculate gives for windows
+        with ambiguous bases, has a NaN p-value.
+        """
+        bg_tail = self._cumulative()[0]
+        x = np.asarray(score, dtype=float) - self.min_score
+        nan = np.isnan(x)
+        i = np.floor_divide(np.where(nan, 0.0, x) + 0.5 * self.step, self.step)
+        p = np.where(nan, np.nan, bg_tail[np.clip(i, 0, self.n_points).astype(int)])
+        if p.ndim == 0:
+            return float(p)
+        return p
 
     def threshold_patser(self):
         """Threshold selection mimicking the behaviour of patser (Hertz, Stormo 1999) software.
@@ -107,3 +179,111 @@ class ScoreDistribution:
         are not directly comparable.
         """
         return self.threshold_fpr(fpr=2**-self.ic)
+
+
+class DistributionCache:
+    """Cache of score distributions, in memory and optionally on disk.
+
+    Distributions are keyed by a hash of the PSSM values, the background
+    and the precision, so the same motif gets the same entry in every run,
+    whatever it is called. The most recently used maxsize distributions are
+    kept in memory. If a directory is given, every distribution computed is
+    also stored there as a small .npz file, and later runs load it from
+    there instead of computing it again.
+
+    >>> cache = DistributionCache("thresholds-cache")  # doctest: +SKIP
+    >>> distribution = pssm.distribution(background, cache=cache)  # doctest: +SKIP
+    """
+
+    # bump this when the stored arrays or their meaning change
+    version = 1
+
+    def __init__(self, directory=None, maxsize=128):
+        """Initialize the class."""
+        self.directory = directory
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def key(self, pssm, background, precision):
+        """Return the hash identifying the distribution of a PSSM."""
+        digest = hashlib.sha256()
+        digest.update(b"%d %d %s" % (self.version, precision, pssm.alphabet.encode()))
+        values = [pssm[letter] for letter in pssm.alphabet]
+        digest.update(np.asarray(values, dtype=float).tobytes())
+        probs = [background[letter] for letter in pssm.alphabet]
+        digest.update(np.asarray(probs, dtype=float).tobytes())
+        return digest.hexdigest()
+
+    def get(self, pssm, background, precision):
+        """Return the score distribution, computing it only if not cached."""
+        key = self.key(pssm, background, precision)
+        distribution = self._memory.get(key)
+        if distribution is not None:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return distribution
+        distribution = self._load(key)
+        if distribution is None:
+            self.misses += 1
+            distribution = ScoreDistribution(
+                precision=precision, pssm=pssm, background=background
+            )
+            self._store(key, distribution)
+        else:
+            self.hits += 1
+        self._memory[key] = distribution
+        if len(self._memory) > self.maxsize:
+            self._memory.popitem(last=False)
+        return distribution
+
+    def clear(self):
+        """Empty the in-memory cache; files on disk are kept."""
+        self._memory.clear()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def _load(self, key):
+        if self.directory is None:
+            return None
+        try:
+            with np.load(self._path(key), allow_pickle=False) as data:
+                distribution = ScoreDistribution.__new__(ScoreDistribution)
+                distribution.min_score, distribution.interval = data["scores"][:2]
+                distribution.step, distribution.ic = data["scores"][2:]
+                distribution.n_points = len(data["mo_density"])
+                distribution.mo_density = data["mo_density"]
+                distribution.bg_density = data["bg_density"]
+        except (OSError, KeyError, ValueError):
+            # missing or damaged files are simply computed again
+            return None
+        return distribution
+
+    def _store(self, key, distribution):
+        if self.directory is None:
+            return
+        scores = [
+            distribution.min_score,
+            distribution.interval,
+            distribution.step,
+            distribution.ic,
+        ]
+        # write to a temporary file first, so that concurrent runs never
+        # see a partly written entry
+        handle, name = tempfile.mkstemp(suffix=".npz", dir=self.directory)
+        try:
+            with os.fdopen(handle, "wb") as f:
+                np.savez(
+                    f,
+                    scores=np.array(scores),
+                    mo_density=distribution.mo_density,
+                    bg_density=distribution.bg_density,
+                )
+            os.replace(name, self._path(key))
+        except BaseException:
+            os.unlink(name)
+            raise